@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+announcements.py -- incrementally maintained set of nearly sold out conferences
+
+The set is a single NearlySoldOut entity mapping websafe conference keys to
+conference names (read through ndb's memcache cache). Write paths report the
+seats a conference has left, and the set is only written when a conference
+crosses into or out of the nearly sold out range, or a member is renamed.
+The cached announcement is rebuilt from the set the transaction wrote, and
+published again while the set read back has changed since, so the last of
+concurrent writers always publishes the latest set. It never needs a query
+over every conference; the announcement cron only reconciles the set with
+such a query, to repair any drift.
+"""
+
+from google.appengine.ext import ndb
+
+from models import NearlySoldOut
+
+import cacheaside
+
+from settings import ANNOUNCEMENT_FRESH_SECONDS
+from settings import MEMCACHE_ANNOUNCEMENTS_KEY
+from settings import NEARLY_SOLD_OUT_SEATS
+
+
+_SET_KEY = ndb.Key(NearlySoldOut, 'conferences')
+
+
+def isNearlySoldOut(seats):
+    """Return whether a conference with this many seats left is nearly sold out"""
+    return 0 < (seats or 0) <= NEARLY_SOLD_OUT_SEATS
+
+
+def members():
+    """Return the names of the nearly sold out conferences, by websafe conference key"""
+    entity = _SET_KEY.get()
+    return entity.conferences if entity else {}
+
+
+def _announce(conferences):
+    names = sorted(conferences.values())
+    if names:
+        return '%s %s' % (
+            'Last chance to attend! The following conferences '
+            'are nearly sold out:',
+            ', '.join(names))
+    return ""
+
+
+def announcement(arg=''):
+    """Return the announcement of the nearly sold out conferences, or an empty string if there are none"""
+    return _announce(members())
+
+
+@ndb.transactional()
+def _update(wsck, name):
+    """Set the name of a conference in the set, or remove it when name is None;
+    returns the set as written"""
+    entity = _SET_KEY.get() or NearlySoldOut(key=_SET_KEY)
+    conferences = dict(entity.conferences or {})
+    if conferences.get(wsck) == name:
+        return conferences
+    if name is None:
+        del conferences[wsck]
+    else:
+        conferences[wsck] = name
+    entity.conferences = conferences
+    entity.put()
+    return conferences
+
+
+def _publish(conferences):
+    """Publish the announcement of a set just written, then again for as long as the set read
+    back has changed, so a writer that committed earlier cannot overwrite a later set"""
+    while True:
+        cacheaside.put(MEMCACHE_ANNOUNCEMENTS_KEY, _announce(conferences))
+        entity = _SET_KEY.get(use_cache=False, use_memcache=False)
+        current = entity.conferences if entity else {}
+        if current == conferences:
+            return
+        conferences = current
+
+
+def seatsChanged(conf, seats):
+    """Put a conference in or take it out of the set if its seats crossed the nearly sold out
+    range (or it was renamed); nothing is written otherwise"""
+    wsck = conf.key.urlsafe()
+    name = conf.name if isNearlySoldOut(seats) else None
+    if members().get(wsck) != name:
+        _publish(_update(wsck, name))
+
+
+def conferenceDeleted(wsck):
+    """Take a deleted conference out of the set"""
+    if wsck in members():
+        _publish(_update(wsck, None))
+
+
+def reconcile(confs):
+    """Replace the set with the given nearly sold out conferences; used by the announcement cron"""
+    conferences = dict((conf.key.urlsafe(), conf.name) for conf in confs)
+    if members() != conferences:
+        NearlySoldOut(key=_SET_KEY, conferences=conferences).put()
+    _publish(conferences)
+    return _announce(conferences)
+
+
+cacheaside.register(MEMCACHE_ANNOUNCEMENTS_KEY, announcement, ANNOUNCEMENT_FRESH_SECONDS)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""
+cacheaside.py -- stampede-safe memcache cache-aside with stale-while-revalidate
+
+Each cached value is registered with the function computing it and how long it
+stays fresh, and is stored in memcache together with the time it goes stale.
+A read of a fresh value just returns it. A stale value is still returned, and
+a single refresh task (deduplicated by name) recomputes it in the background.
+A missing value is recomputed inline by the one request that wins a memcache
+add() lock, while concurrent requests wait for its result instead of all
+hitting the datastore at once.
+"""
+
+import hashlib
+import logging
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+
+from settings import CACHE_LOCK_SECONDS
+from settings import CACHE_WAIT_SECONDS
+from settings import MEMCACHE_CACHE_LOCK_PREFIX
+
+
+# cache name -> (function computing the value from an argument, seconds the value stays fresh)
+_REGISTRY = {}
+
+_WAIT_INTERVAL = 0.1
+
+
+def register(name, compute, fresh_for):
+    """Register a cached value: compute(arg) returns it, and it is refreshed after fresh_for seconds"""
+    _REGISTRY[name] = (compute, fresh_for)
+
+
+def _key(name, arg):
+    return '%s:%s' % (name, arg) if arg else name
+
+
+def _store(name, arg, value):
+    memcache.set(_key(name, arg), (value, time.time() + _REGISTRY[name][1]))
+    return value
+
+
+def put(name, value, arg=''):
+    """Store a value computed elsewhere (e.g. by a write path) as fresh"""
+    return _store(name, arg, value)
+
+
+def refresh(name, arg=''):
+    """Recompute and store a value; used by the refresh cache task"""
+    compute = _REGISTRY[name][0]
+    return _store(name, arg, compute(arg))
+
+
+def _queueRefresh(name, arg):
+    """Queue one refresh task per value and fresh period; later requests find it already queued"""
+    fresh_for = _REGISTRY[name][1]
+    window = int(time.time() / max(fresh_for, 1))
+    try:
+        taskqueue.add(name='refresh-%s-%d' % (hashlib.md5(_key(name, arg)).hexdigest(), window),
+                      params={'name': name, 'arg': arg},
+                      url='/tasks/refresh_cache'
+                      )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def get(name, arg=''):
+    """Return a cached value, recomputing it at most once however many requests miss at the same time"""
+    cached = memcache.get(_key(name, arg))
+    if cached is not None:
+        value, stale_at = cached
+        if stale_at < time.time():
+            _queueRefresh(name, arg)
+        return value
+
+    lock = MEMCACHE_CACHE_LOCK_PREFIX + _key(name, arg)
+    if memcache.add(lock, 1, time=CACHE_LOCK_SECONDS):
+        try:
+            return refresh(name, arg)
+        finally:
+            memcache.delete(lock)
+
+    # another request is recomputing the value; wait for it rather than recompute it too
+    deadline = time.time() + CACHE_WAIT_SECONDS
+    while time.time() < deadline:
+        time.sleep(_WAIT_INTERVAL)
+        cached = memcache.get(_key(name, arg))
+        if cached is not None:
+            return cached[0]
+
+    logging.warning('Gave up waiting for %s to be recomputed; computing it again', _key(name, arg))
+    return _REGISTRY[name][0](arg)
@@ -6,14 +6,11 @@ conference.py -- Udacity conference server-side Python App Engine API;
 
 """
 
-from datetime import time
-
 import endpoints
 import logging
 from protorpc import message_types
 from protorpc import remote
 
-from google.appengine.api import memcache
 from google.appengine.ext import ndb
 
 from models import Profile
@@ -29,20 +26,35 @@ from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForms
+from models import ConferenceDetailForm
 from models import ConferenceSession
 from models import ConferenceSessionForm
 from models import ConferenceSessionForms
+from models import SessionQueryForms
 from models import Wishlist
 from models import WishlistForm
 from models import SessionType
 
 from conferenceapihelper import ConferenceApiHelper
+from entitycache import invalidate
+import announcements
+import cacheaside
+import seatcounter
+import responsecache
+import sessionfilter
+from rpcstats import instrument
 
 from settings import WEB_CLIENT_ID
 from settings import EMAIL_SCOPE
 from settings import API_EXPLORER_CLIENT_ID
 from settings import MEMCACHE_ANNOUNCEMENTS_KEY
+from settings import MEMCACHE_FEATURED_SPEAKER_KEY
+from settings import NEARLY_SOLD_OUT_SEATS
+from settings import FEATURED_SPEAKER_FRESH_SECONDS
 from settings import CONF_GET_REQUEST
+from settings import CONF_CREATED_REQUEST
+from settings import PAGE_GET_REQUEST
+from settings import SEARCH_GET_REQUEST
 from settings import SESS_BY_TYPE_GET_REQUEST
 from settings import CONF_BY_TYPE_GET_REQUEST
 from settings import CONF_BY_SPKR_GET_REQUEST
@@ -67,6 +79,7 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
     @endpoints.method(ConferenceForm, ConferenceForm,
                       path='conference',
                       http_method='POST', name='createConference')
+    @instrument
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -74,6 +87,7 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='PUT', name='updateConference')
+    @instrument
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
         return self._updateConferenceObject(request)
@@ -81,6 +95,7 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='DELETE', name='deleteConference')
+    @instrument
     def deleteConference(self, request):
         """Delete conference."""
         wsck = request.websafeConferenceKey
@@ -88,103 +103,108 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
         if not conf:
             raise endpoints.NotFoundException('No conference found with key: %s' % wsck)
 
-        # Remove the link between the sessions and this conference
-        conf_sess = ConferenceSession.query(ancestor=conf.key)
-        if conf_sess:
-            for sess in conf_sess:
-                wssk = sess.key.urlsafe()
-
-                # Get all the wishlists that have this session in them and remove this session from them
-                wishes = Wishlist.query(ndb.AND(Wishlist.sessions == wssk))
-                for wish in wishes:
-                    if wish and wssk in wish.sessions:
-                        wish.sessions.remove(wssk)
-                        wish.put()
-
-                sess.key.delete()
-
-        # Unregister the users from this conference if they are registered for it
-        registered_users = Profile.query(ndb.AND(Profile.conferenceKeysToAttend == wsck))
-        if registered_users:
-            for reg_user in registered_users:
-                if reg_user and wsck in reg_user.conferenceKeysToAttend:
-                    reg_user.conferenceKeysToAttend.remove(wsck)
-                    reg_user.put()
-
-        conf.key.delete()
+        # Removing the sessions, wishlist entries and registrations is left to the task queue
+        self._deleteConferenceObject(conf)
 
         return BooleanMessage(data=True)
 
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='GET', name='getConference')
+    @instrument
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
         conf = self._retrieveConference(request.websafeConferenceKey)
         if not conf:
             raise endpoints.NotFoundException('No conference found with key: %s' % request.websafeConferenceKey)
         
-        prof = conf.key.parent().get()
-        
-        return self.toConferenceForm(conf, getattr(prof, 'displayName'))
+        self._fillOrganizerNames([conf])
+        # report the live total of the seat shards rather than the periodically synced copy
+        conf.seatsAvailable = seatcounter.seatsAvailable(conf.key.urlsafe())
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+        return self.toConferenceForm(conf)
+
+    @endpoints.method(CONF_GET_REQUEST, ConferenceDetailForm,
+                      path='conference/{websafeConferenceKey}/detail',
+                      http_method='GET', name='getConferenceDetail')
+    @instrument
+    def getConferenceDetail(self, request):
+        """Return a conference with its sessions, speakers and the caller's registration in one call."""
+        return self._getConferenceDetail(request.websafeConferenceKey)
+
+    @endpoints.method(CONF_CREATED_REQUEST, ConferenceForms,
                       path='getConferencesCreated',
                       http_method='POST', name='getConferencesCreated')
+    @instrument
     def getConferencesCreated(self, request):
-        """Return conferences created by user."""
+        """Return conferences created by user (only names and dates when a summary is requested)."""
         user_id = self._getUser()
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
+        query = Conference.query(ancestor=ndb.Key(Profile, user_id))
+        if request.summary:
+            # projection query served from the index alone
+            confs = self._fetchAll(query, projection=[Conference.name, Conference.startDate, Conference.endDate])
+        else:
+            confs = self._fetchAll(query)
+            self._fillOrganizerNames(confs)
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self.toConferenceForm(conf, getattr(self._getUserProfile(user_id), 'displayName')) for conf in confs]
+            items=self.toConferenceForms(confs)
         )
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
                       path='queryConferences',
                       http_method='POST', name='queryConferences')
+    @instrument
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+        """Query for conferences in name order, one page at a time."""
+        conferences, next_token = self._queryConferences(request)
 
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        self._fillOrganizerNames(conferences)
 
         # return individual ConferenceForm object per Conference
         return ConferenceForms(
-            items=[self.toConferenceForm(conf, names[conf.organizerUserId]) for conf in conferences]
+            items=self.toConferenceForms(conferences),
+            nextPageToken=next_token
         )
 
+    @endpoints.method(SEARCH_GET_REQUEST, ConferenceForms,
+                      path='searchConferences',
+                      http_method='GET', name='searchConferences')
+    @instrument
+    def searchConferences(self, request):
+        """Search conferences by the words of their name and description, best match first."""
+        return self._searchConferences(request)
+
 # - - - Session endpoints - - - - - - - - - - - - - - - - - - - 
 
     @endpoints.method(CONF_GET_REQUEST, ConferenceSessionForms,
                       path='conference/{websafeConferenceKey}/sessions',
                       http_method='GET', name='getConferenceSessions')
+    @instrument
     def getConferenceSessions(self, request):
         """Given a conference, return all sessions"""
         profile = self._getUserProfile()
-        conf = self._retrieveConference(request.websafeConferenceKey)
-        if not conf:
-            raise endpoints.NotFoundException('No conference found with key: %s' % request.websafeConferenceKey)
 
-        conf_sess = ConferenceSession.query(ancestor=conf.key)
+        def build():
+            conf = self._retrieveConference(request.websafeConferenceKey)
+            if not conf:
+                raise endpoints.NotFoundException('No conference found with key: %s' % request.websafeConferenceKey)
 
-        # return set of ConferenceSessionForm objects per ConferenceSession
-        return ConferenceSessionForms(
-            items=[self.toConferenceSessionForm(cs) for cs in conf_sess]
-        )
+            conf_sess = ConferenceSession.query(ancestor=conf.key)
+
+            # return set of ConferenceSessionForm objects per ConferenceSession
+            return ConferenceSessionForms(
+                items=self.toConferenceSessionForms(conf_sess)
+            )
+
+        return responsecache.getOrBuild('getConferenceSessions', request, ConferenceSessionForms,
+                                        [responsecache.conferenceScope(request.websafeConferenceKey)], build)
         
     @endpoints.method(CONF_WISH_REQUEST, ConferenceSessionForm,
                       path='session/{websafeSessionKey}',
                       http_method='GET', name='getConferenceSession')
+    @instrument
     def getConferenceSession(self, request):
         """Get a conference session by key"""
         conf_sess = self._retrieveSession(request.websafeSessionKey)
@@ -193,37 +213,50 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
         
         speakerDisplayName = None
         if conf_sess.speakerUserId:
-            speaker = self._getSpeaker(conf_sess.speakerUserId)
-            speakerDisplayName = speaker.displayName
+            # the speaker may have been removed while the session is still being detached from them
+            speaker = self._getSpeakers([conf_sess.speakerUserId], bail=False).get(conf_sess.speakerUserId)
+            speakerDisplayName = getattr(speaker, 'displayName', None)
 
         return self.toConferenceSessionForm(conf_sess, speakerDisplayName)
 
-    @endpoints.method(message_types.VoidMessage, ConferenceSessionForms,
+    @endpoints.method(PAGE_GET_REQUEST, ConferenceSessionForms,
                       path='sessions',
                       http_method='GET', name='getAllSessions')
+    @instrument
     def getAllSessions(self, request):
-        """return all sessions"""
-        conf_sess = ConferenceSession.query()
+        """return all sessions (or one page of them); use /export/sessions for bulk reads"""
+        def build():
+            conf_sess, next_token = self._fetchRequested(ConferenceSession.query(), request)
 
-        # return set of ConferenceSessionForm objects
-        return ConferenceSessionForms(
-            items=[self.toConferenceSessionForm(cs) for cs in conf_sess]
-        )
+            # return set of ConferenceSessionForm objects
+            return ConferenceSessionForms(
+                items=self.toConferenceSessionForms(conf_sess),
+                nextPageToken=next_token
+            )
+
+        return responsecache.getOrBuild('getAllSessions', request, ConferenceSessionForms,
+                                        [responsecache.SESSIONS], build)
 
     @endpoints.method(SESS_BY_TYPE_GET_REQUEST, ConferenceSessionForms,
                       path='sessions/type/{sessionType}',
                       http_method='GET', name='getAllSessionsByType')
+    @instrument
     def getAllSessionsByType(self, request):
         """Given a conference, return all sessions of a specified type (eg lecture, keynote, workshop)"""
-        sessions = ConferenceSession.query(ndb.AND(ConferenceSession.typeOfSession == request.sessionType))
-        # return set of ConferenceSessionForm objects per ConferenceSession
-        return ConferenceSessionForms(
-            items=[self.toConferenceSessionForm(cs) for cs in sessions]
-        )
+        def build():
+            sessions = ConferenceSession.query(ndb.AND(ConferenceSession.typeOfSession == request.sessionType))
+            # return set of ConferenceSessionForm objects per ConferenceSession
+            return ConferenceSessionForms(
+                items=self.toConferenceSessionForms(sessions)
+            )
+
+        return responsecache.getOrBuild('getAllSessionsByType', request, ConferenceSessionForms,
+                                        [responsecache.SESSIONS], build)
         
     @endpoints.method(CONF_BY_TYPE_GET_REQUEST, ConferenceSessionForms,
                       path='conference/{websafeConferenceKey}/sessions/type/{sessionType}',
                       http_method='GET', name='getConferenceSessionsByType')
+    @instrument
     def getConferenceSessionsByType(self, request):
         """Given a conference, return all sessions of a specified type (eg lecture, keynote, workshop)"""
         conf = self._retrieveConference(request.websafeConferenceKey)
@@ -235,38 +268,53 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
 
         # return set of ConferenceSessionForm objects per ConferenceSession
         return ConferenceSessionForms(
-            items=[self.toConferenceSessionForm(cs) for cs in sessions]
+            items=self.toConferenceSessionForms(sessions)
         )
 
     @endpoints.method(message_types.VoidMessage, ConferenceSessionForms,
                       path='sessions/earlynonworkshop',
                       http_method='GET', name='getDaytimeNonWorkshopSessions')
+    @instrument
     def getDaytimeNonWorkshopSessions(self, request):
         """Get sessions before 7pm and non-worksop"""
-        conf_sess = ConferenceSession.query(ConferenceSession.typeOfSession.IN([
-            str(SessionType.UNKNOWN),
-            str(SessionType.LECTURE),
-            str(SessionType.KEYNOTE),
-            str(SessionType.MEETUP)
-        ]))
-        no_early_workshop = conf_sess.filter(ConferenceSession.startTime < time(19,00))
-        if no_early_workshop:
+        def build():
+            # two inequalities, so this runs on the in-memory session filter rather than the datastore
+            no_early_workshop = sessionfilter.querySessions([
+                ('typeOfSession', '!=', SessionType.WORKSHOP.number),
+                ('startTime', '<', 19 * 60)
+            ])
+
             # return set of ConferenceSessionForm objects per ConferenceSession
-            return ConferenceSessionForms(
-                items=[self.toConferenceSessionForm(cs) for cs in no_early_workshop]
-            )
-        else:
-            return ConferenceSessionForms(
-                items=[self.toConferenceSessionForm()]
-            )
+            return self._toSessionForms(no_early_workshop)
+
+        return responsecache.getOrBuild('getDaytimeNonWorkshopSessions', request, ConferenceSessionForms,
+                                        [responsecache.SESSIONS], build)
+
+    @endpoints.method(SessionQueryForms, ConferenceSessionForms,
+                      path='querySessions',
+                      http_method='POST', name='querySessions')
+    @instrument
+    def querySessions(self, request):
+        """Query for sessions on any combination of type, start time, duration, date and conference."""
+        wssks = sessionfilter.querySessions(self._formatSessionFilters(request.filters))
+        return self._toSessionForms(wssks, request.pageSize, request.pageToken)
+
+    @endpoints.method(SEARCH_GET_REQUEST, ConferenceSessionForms,
+                      path='searchSessions',
+                      http_method='GET', name='searchSessions')
+    @instrument
+    def searchSessions(self, request):
+        """Search sessions by the words of their name and highlights, best match first."""
+        return self._searchSessions(request)
 
     @endpoints.method(CONF_BY_SPKR_GET_REQUEST, ConferenceSessionForms,
                       path='sessions/speaker/{speakerUserId}',
                       http_method='GET', name='getSessionsBySpeaker')
+    @instrument
     def getSessionsBySpeaker(self, request):
         """Given a speaker, return all sessions given by this particular speaker, across all conferences"""
-        conf_sess = ConferenceSession.query(ndb.AND(ConferenceSession.speakerUserId == request.speakerUserId))
-        speaker = self._getSpeaker(request.speakerUserId)
+        speaker = self._getSpeakers([request.speakerUserId])[request.speakerUserId]
+        conf_sess = self._getSpeakerSessions(speaker)
         # return set of ConferenceSessionForm objects per ConferenceSession
         return ConferenceSessionForms(
             items=[self.toConferenceSessionForm(cs, getattr(speaker, 'displayName')) for cs in conf_sess]
@@ -275,6 +323,7 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
     @endpoints.method(CONF_SESS_POST_REQUEST, ConferenceSessionForm,
                       path='conference/{websafeConferenceKey}/sessions',
                       http_method='POST', name='createConferenceSession')
+    @instrument
     def createSession(self, request):
         """Create new session (open only to the organizer of the conference"""
         return self._createConferenceSessionObject(request)
@@ -282,19 +331,37 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
     @endpoints.method(CONF_WISH_REQUEST, BooleanMessage,
                       path='session/{websafeSessionKey}',
                       http_method='DELETE', name='deleteConferenceSession')
+    @instrument
     def deleteConferenceSession(self, request):
         """Remove session"""
-        sess = ndb.Key(urlsafe=request.websafeSessionKey).get()
-        if not sess:
-            raise endpoints.NotFoundException('No session found with key: %s' % request.websafeSessionKey)
-
-        sess.key.delete()
+        self._deleteConferenceSessionObject(request.websafeSessionKey)
 
         return BooleanMessage(data=True)
 
+    @staticmethod
+    def _computeFeaturedSpeaker(speaker_key, conf_key=None):
+        """Return the summary of a speaker's sessions at a conference when they speak at more than
+        one, otherwise an empty string; without a conference, the one they were last added to"""
+        speaker = ndb.Key(urlsafe=speaker_key).get()
+        if not speaker:
+            return ""
+        if not conf_key:
+            if not speaker.sessionKeysToSpeakAt:
+                return ""
+            conf_key = ndb.Key(urlsafe=speaker.sessionKeysToSpeakAt[-1]).parent().urlsafe()
+
+        # Now retrieve all sessions  for that conference at which this speaker will speak
+        sessions = ConferenceApi._getSpeakerSessions(speaker, ndb.Key(urlsafe=conf_key))
+        if sessions and len(sessions) > 1:
+            return '%s %s %s' % (
+                speaker.displayName,
+                'will be speaking at the following sessions: ',
+                ', '.join(sess.name for sess in sessions))
+        return ""
+
     @staticmethod
     def _cacheSpeakerAndSession(speaker_key, conf_key):
-        """Assign Speaker and their Session to memcache; used by memcache cron job """
+        """Assign Speaker and their Session to memcache; used by the set speaker and sessions task"""
         session_message = ""
 
         # Make sure the conference and speaker are both valid
@@ -303,21 +370,10 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
             speaker = ndb.Key(urlsafe=speaker_key).get()
 
             if conf and speaker:
-                # Now retrieve all sessions  for that conference at which this speaker will speak
-                sessions = ConferenceSession.query(ancestor=conf.key)\
-                    .filter(ndb.AND(ConferenceSession.speakerUserId == speaker_key))\
-                    .fetch(projection=[Conference.name])
-
                 # If this speaker is supposed to speak at multiple sessions,
-                # throw a summary of all their sessions into the task queue
-                if sessions and len(sessions) > 1:
-                    session_message = '%s %s %s' % (
-                        speaker.displayName,
-                        'will be speaking at the following sessions: ',
-                        ', '.join(sess.name for sess in sessions))
-                    memcache.set(speaker.mainEmail, session_message)
-                else:
-                    memcache.delete(speaker.mainEmail)
+                # cache a summary of all their sessions at this conference
+                session_message = ConferenceApi._computeFeaturedSpeaker(speaker_key, conf_key)
+                cacheaside.put(MEMCACHE_FEATURED_SPEAKER_KEY, session_message, speaker_key)
             elif not conf:
                 logging.error('No conference found with key: %s' % conf_key)
             elif not speaker:
@@ -334,6 +390,7 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
     @endpoints.method(CONF_WISH_POST_REQUEST, WishlistForm,
                       path='session/{websafeSessionKey}/wishlist',
                       http_method='POST', name='addSessionToWishlist')
+    @instrument
     def addSessionToWishlist(self, request):
         """Adds the session to the user's list of sessions they are interested in attending"""
         return self._createWishlistObject(request)
@@ -341,6 +398,7 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
     @endpoints.method(message_types.VoidMessage, WishlistForm,
                       path='session/wishlist/full',
                       http_method='GET', name='getSessionsInWishlist')
+    @instrument
     def getSessionsInWishlist(self, request):
         """Query for all the sessions in a conference that the user is interested in attending"""
         p_key = self._getUserProfileKey()
@@ -349,16 +407,12 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
         if not wish:
             raise endpoints.NotFoundException('Your wishlist could not be found')
 
-        wf = {'key': p_key, 'sessions': []}
-
-        if len(wish.sessions) and any(s for s in wish.sessions):
-            wf['sessions'] = [self._retrieveSession(cs_id) for cs_id in wish.sessions if cs_id is not None]
-
-        return self.toWishlistForm(wf)
+        return self.toWishlistForm(self._hydrateWishlist(wish))
 
     @endpoints.method(CONF_WISH_REQUEST, BooleanMessage,
                       path='session/{websafeSessionKey}/wishlist',
                       http_method='DELETE', name='deleteSessionInWishlist')
+    @instrument
     def deleteSessionInWishlist(self, request):
         """Removes the session from the users list of sessions they are interested in attending"""
         user_id = self._getUser()
@@ -384,24 +438,28 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
     @endpoints.method(message_types.VoidMessage, ProfileForm,
                       path='profile',
                       http_method='GET', name='getProfile')
+    @instrument
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
 
-    @endpoints.method(message_types.VoidMessage, ProfileForms,
+    @endpoints.method(PAGE_GET_REQUEST, ProfileForms,
                       path='profiles',
                       http_method='GET', name='getProfiles')
+    @instrument
     def getProfiles(self, request):
-        """Return users (regardless if they are speakers)."""
-        profiles = Profile.query()
+        """Return users (regardless if they are speakers); use /export/profiles for bulk reads."""
+        profiles, next_token = self._fetchRequested(Profile.query(), request)
         # return set of ProfileForm objects
         return ProfileForms(
-            profiles=[self.toProfileForm(profile) for profile in profiles]
+            profiles=self.toProfileForms(profiles),
+            nextPageToken=next_token
         )
         
     @endpoints.method(ProfileMiniForm, ProfileForm,
                       path='profile',
                       http_method='POST', name='saveProfile')
+    @instrument
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
@@ -409,6 +467,7 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
     @endpoints.method(CONF_GET_REQUEST, SpeakerForms,
                       path='conference/{websafeConferenceKey}/speakers',
                       http_method='GET', name='getConferenceSpeakers')
+    @instrument
     def getConferenceSpeakers(self, request):
         """Return users assigned as speakers for a given conference's sessions."""
         conf = self._retrieveConference(request.websafeConferenceKey)
@@ -416,7 +475,7 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
             raise endpoints.NotFoundException('No conference found with key: %s' % request.websafeConferenceKey)
         
         # get all the sessions for this conference
-        conf_sess = ConferenceSession.query(ancestor=conf.key)
+        conf_sess = self._fetchAll(ConferenceSession.query(ancestor=conf.key))
         if not conf_sess:
             raise endpoints.NotFoundException('No sessions were found for this conference')
         
@@ -425,42 +484,50 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
         if not len(speaker_ids):
             raise endpoints.NotFoundException('No speakers are listed for any of this conference sessions')
         
+        # resolve every distinct speaker with one batched lookup
+        speakers = self._getSpeakers(speaker_ids)
+
         return SpeakerForms(
-            speakers=[self.toSpeakerForm(
-                self._getSpeaker(speaker)
-            ) for speaker in set(speaker_ids)]
+            speakers=self.toSpeakerForms(speakers.values())
         )
 
     @endpoints.method(CONF_SPKR_GET_REQUEST, StringMessage,
                       path='speaker/{websafeSpeakerKey}/summary',
                       http_method='GET', name='getFeaturedSpeaker')
+    @instrument
     def getFeaturedSpeaker(self, request):
         """Return speaker and conference summary from memcache."""
         speaker = self._getSpeaker(request.websafeSpeakerKey)
         if not speaker:
             raise endpoints.NotFoundException('A speaker was not found matching key %s' % request.websafeSpeakerKey)
 
-        # return an existing speaker/conference summary from Memcache or an empty string.
-        speaker_session_summary = memcache.get(speaker.mainEmail)
-        if not speaker_session_summary:
-            speaker_session_summary = ""
+        # return the speaker/conference summary from memcache, recomputing it once if it was evicted
+        speaker_session_summary = cacheaside.get(MEMCACHE_FEATURED_SPEAKER_KEY, speaker.key.urlsafe())
 
         return StringMessage(data=speaker_session_summary)
 
-    @endpoints.method(message_types.VoidMessage, SpeakerForms,
+    @endpoints.method(PAGE_GET_REQUEST, SpeakerForms,
                       path='speakers',
                       http_method='GET', name='getSpeakers')
+    @instrument
     def getSpeakers(self, request):
-        """Return users who may be assigned as speakers for a conference session."""
-        speakers = Speaker.query()
-        # return set of SpeakerForm objects
-        return SpeakerForms(
-            speakers=[self.toSpeakerForm(speaker) for speaker in speakers]
-        )
+        """Return users who may be assigned as speakers for a conference session;
+        use /export/speakers for bulk reads."""
+        def build():
+            speakers, next_token = self._fetchRequested(Speaker.query(), request)
+            # return set of SpeakerForm objects
+            return SpeakerForms(
+                speakers=self.toSpeakerForms(speakers),
+                nextPageToken=next_token
+            )
+
+        return responsecache.getOrBuild('getSpeakers', request, SpeakerForms,
+                                        [responsecache.SPEAKERS], build)
 
     @endpoints.method(CONF_SPKR_GET_REQUEST, SpeakerForm,
                       path='speaker/{websafeSpeakerKey}',
                       http_method='GET', name='getSpeaker')
+    @instrument
     def getSpeaker(self, request):
         """Return a speaker by their unique id."""
         speaker = self._getSpeaker(request.websafeSpeakerKey)
@@ -470,6 +537,7 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
     @endpoints.method(CONF_SPKR_POST_REQUEST, SpeakerForm,
                       path='speaker',
                       http_method='POST', name='createSpeaker')
+    @instrument
     def createSpeaker(self, request):
         """Create a new speaker."""
         return self._createSpeaker(request)
@@ -477,6 +545,7 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
     @endpoints.method(CONF_SPKR_POST_REQUEST, SpeakerForm,
                       path='speaker/{websafeSpeakerKey}',
                       http_method='PUT', name='saveSpeaker')
+    @instrument
     def saveSpeaker(self, request):
         """Update & return speaker."""
         return self._createSpeaker(request)
@@ -484,24 +553,21 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
     @endpoints.method(CONF_SPKR_GET_REQUEST, BooleanMessage,
                       path='speaker/{websafeSpeakerKey}',
                       http_method='DELETE', name='removeSpeaker')
+    @instrument
     def removeSpeaker(self, request):
         """Remove the Speaker."""
         wssk = request.websafeSpeakerKey
-        spkr = ndb.Key(urlsafe=wssk).get()
+        # read from the datastore itself: its sessionKeysToSpeakAt decides which sessions are rewritten
+        spkr = ndb.Key(urlsafe=wssk).get(use_cache=False, use_memcache=False)
         if not spkr:
             raise endpoints.NotFoundException('No speaker found with key: %s' % wssk)
 
-        sessions = ConferenceSession.query(ndb.AND(
-            ConferenceSession.speakerUserId == request.websafeSpeakerKey)
-        ).fetch()
-
         # Remove the association this speaker has with any sessions
-        if sessions:
-            for session in sessions:
-                session.speakerUserId = None
-                session.put()
+        self._detachSpeaker(spkr)
 
         spkr.key.delete()
+        invalidate(spkr.key)
+        responsecache.bump(responsecache.SPEAKERS)
 
         return BooleanMessage(data=True)
         
@@ -510,41 +576,31 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='conferences/attending',
                       http_method='GET', name='getConferencesToAttend')
+    @instrument
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
 
         # Get the conferences the user is registered to attend
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
+        conf_keys = prof.conferenceKeysToAttend
         if not conf_keys or not len(conf_keys):
             return ConferenceForms(items=[])
         else:
-            conferences = ndb.get_multi(conf_keys)
-            if not any(c for c in conferences):
-                wskeys = ', '.join([wkey.urlsafe() for wkey in conf_keys])
+            conferences = [conf for conf in self._getEntities(conf_keys) if conf is not None]
+            if not conferences:
                 raise endpoints.NotFoundException(
-                    'The conferences to which you are registered could not be found: %s' % wskeys
+                    'The conferences to which you are registered could not be found: %s' % ', '.join(conf_keys)
                 )
 
-            # get all the conference organizers
-            organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences if conf is not None]
-            if not len(organisers):
-                raise endpoints.NotFoundException('No conference organisers were found for these conferences')
-            profiles = ndb.get_multi(organisers)
-
-            # put display names in a dict for easier fetching
-            names = {}
-            for profile in profiles:
-                names[profile.key.id()] = profile.displayName
+            self._fillOrganizerNames(conferences)
 
             # return set of ConferenceForm objects per Conference
-            return ConferenceForms(items=[
-                self.toConferenceForm(conf, names[conf.organizerUserId]) for conf in conferences if conf is not None
-            ])
+            return ConferenceForms(items=self.toConferenceForms(conferences))
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}/register',
                       http_method='POST', name='registerForConference')
+    @instrument
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
@@ -552,6 +608,7 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}/unregister',
                       http_method='DELETE', name='unregisterFromConference')
+    @instrument
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
@@ -560,40 +617,30 @@ class ConferenceApi(remote.Service, ConferenceApiHelper):
 
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Reconcile the nearly sold out conferences with a query over every conference and
+        assign the Announcement to memcache; used by the low-frequency announcement cron.
+        Registrations and updates keep the set current in between.
         """
         confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
             Conference.seatsAvailable > 0)
         ).fetch(projection=[Conference.name])
 
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = '%s %s' % (
-                'Last chance to attend! The following conferences '
-                'are nearly sold out:',
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
-        return announcement
+        return announcements.reconcile(confs)
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='conference/announcement/get',
                       http_method='GET', name='getAnnouncement')
+    @instrument
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        # return an existing announcement from Memcache or an empty string.
-        announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
-        if not announcement:
-            announcement = ""
+        # return the announcement from memcache, recomputing it once if it was evicted
+        announcement = cacheaside.get(MEMCACHE_ANNOUNCEMENTS_KEY)
         return StringMessage(data=announcement)
 
+
+cacheaside.register(MEMCACHE_FEATURED_SPEAKER_KEY, ConferenceApi._computeFeaturedSpeaker,
+                    FEATURED_SPEAKER_FRESH_SECONDS)
+
 # register API
 api = endpoints.api_server([ConferenceApi])
@@ -1,25 +1,55 @@
 #!/usr/bin/env python
 
 from datetime import datetime
+import hashlib
+import json
+import logging
+import time
 
 import endpoints
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
 from models import ConflictException
+from models import Profile
 from models import Speaker
 from models import BooleanMessage
 from models import Conference
+from models import ConferenceDetailForm
+from models import ConferenceForms
 from models import ConferenceSession
+from models import ConferenceSessionForms
 from models import Wishlist
 
+import announcements
+import entitycache
+import queryplanner
+import responsecache
+import searchindex
+import seatcounter
+import sessionfilter
+from entitycache import invalidate
 from entityhelper import EntityHelper
+from utils import getUserId
 
 from settings import DEFAULTS
 from settings import SESSION_DEFAULTS
 from settings import OPERATORS
 from settings import FIELDS
+from settings import SESSION_FIELDS
+from settings import DEFAULT_PAGE_SIZE
+from settings import MAX_PAGE_SIZE
+from settings import QUERY_BATCH_SIZE
+from settings import QUERY_SCAN_BUDGET
+from settings import FANOUT_BATCH_SIZE
+from settings import CASCADE_BATCH_SIZE
+from settings import PUT_BATCH_SIZE
+from settings import SPEAKER_DETACH_INLINE_LIMIT
+from settings import FEATURED_SPEAKER_QUEUE
+from settings import FEATURED_SPEAKER_COUNTDOWN
 
 
 class ConferenceApiHelper(EntityHelper):
@@ -35,7 +65,6 @@ class ConferenceApiHelper(EntityHelper):
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeConferenceKey']
-        del data['organizerDisplayName']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -62,10 +91,16 @@ class ConferenceApiHelper(EntityHelper):
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
+        # store the organizer name on the conference so listings need no Profile reads
+        data['organizerDisplayName'] = request.organizerDisplayName = self._getProfileFromUser().displayName
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        conf = Conference(**data)
+        conf.put()
+        searchindex.documentsWritten('conference', conf)
+        seatcounter.createShards(c_key.urlsafe(), data['seatsAvailable'])
+        announcements.seatsChanged(conf, data['seatsAvailable'])
         # add confirmation email sending task to queue
         user = endpoints.get_current_user()
         taskqueue.add(params={'email': user.email(),
@@ -74,6 +109,100 @@ class ConferenceApiHelper(EntityHelper):
                       )
         return request
 
+    @ndb.transactional()
+    def _deleteConferenceObject(self, conf):
+        """Delete a conference and queue the removal of its sessions and registrations"""
+        conf.key.delete()
+        invalidate(conf.key)
+        searchindex.documentsDeleted('conference', conf.key)
+        responsecache.bump(responsecache.conferenceScope(conf.key.urlsafe()))
+        ndb.get_context().call_on_commit(lambda: announcements.conferenceDeleted(conf.key.urlsafe()))
+        taskqueue.add(params={'websafeConferenceKey': conf.key.urlsafe()},
+                      url='/tasks/delete_conference',
+                      transactional=True
+                      )
+
+    @staticmethod
+    def _cascadeConferenceDelete(wsck, stage=None, page_token=None):
+        """Clean up one batch of a deleted conference's sessions (and the wishlist entries
+        pointing at them) or registrations, then queue the next batch; used by the delete
+        conference task. Each batch is idempotent, so a retried task simply redoes it."""
+        conf_key = ndb.Key(urlsafe=wsck)
+        cursor = Cursor(urlsafe=page_token) if page_token else None
+
+        if stage != 'registrations':
+            sessions, next_cursor, more = ConferenceSession.query(ancestor=conf_key).fetch_page(
+                CASCADE_BATCH_SIZE, start_cursor=cursor)
+            if sessions:
+                sess_keys = [sess.key for sess in sessions]
+                wssks = set(sess_key.urlsafe() for sess_key in sess_keys)
+                wishes = Wishlist.query(Wishlist.sessions.IN(list(wssks))).fetch()
+                for wish in wishes:
+                    wish.sessions = [wssk for wssk in wish.sessions if wssk not in wssks]
+                ndb.put_multi(wishes)
+
+                # drop the sessions from their speakers' session index
+                speaker_keys = list(set(sess.speakerUserId for sess in sessions if sess.speakerUserId))
+                speakers = [speaker for speaker in ndb.get_multi([ndb.Key(urlsafe=k) for k in speaker_keys])
+                            if speaker]
+                for speaker in speakers:
+                    speaker.sessionKeysToSpeakAt = [wssk for wssk in speaker.sessionKeysToSpeakAt
+                                                    if wssk not in wssks]
+                ndb.put_multi(speakers)
+                invalidate(*[speaker.key for speaker in speakers])
+
+                ndb.delete_multi(sess_keys)
+                invalidate(*sess_keys)
+                sessionfilter.sessionsDeleted(*sess_keys)
+                searchindex.documentsDeleted('session', *sess_keys)
+                responsecache.bump(responsecache.SESSIONS, responsecache.SPEAKERS, responsecache.conferenceScope(wsck))
+            if not more:
+                # sessions are done, move on to the registrations from the start
+                stage, next_cursor, more = 'registrations', None, True
+        else:
+            profiles, next_cursor, more = Profile.query(Profile.conferenceKeysToAttend == wsck).fetch_page(
+                CASCADE_BATCH_SIZE, start_cursor=cursor)
+            for prof in profiles:
+                if wsck in prof.conferenceKeysToAttend:
+                    prof.conferenceKeysToAttend.remove(wsck)
+            ndb.put_multi(profiles)
+            if not more:
+                seatcounter.deleteShards(wsck)
+
+        if more:
+            taskqueue.add(params={'websafeConferenceKey': wsck,
+                                  'stage': stage,
+                                  'pageToken': next_cursor.urlsafe() if next_cursor else ''},
+                          url='/tasks/delete_conference'
+                          )
+
+    def _getConferenceDetail(self, wsck):
+        """Gather a conference, its sessions and speakers and the caller's registration,
+        running the independent datastore reads in parallel; returns ConferenceDetailForm."""
+        conf_key = ndb.Key(urlsafe=wsck)
+        user = endpoints.get_current_user()
+
+        # start every independent read at once, then wait on them together
+        conf_future = self._retrieveConferenceAsync(wsck)
+        sess_future = ConferenceSession.query(ancestor=conf_key).fetch_async(batch_size=QUERY_BATCH_SIZE)
+        prof_future = ndb.Key(Profile, getUserId(user)).get_async() if user else None
+
+        conf = conf_future.get_result()
+        self._fillOrganizerNames([conf])
+        conf.seatsAvailable = seatcounter.seatsAvailable(wsck)
+
+        sessions = sess_future.get_result()
+        speakers = self._getSpeakers([sess.speakerUserId for sess in sessions], bail=False)
+        prof = prof_future.get_result() if prof_future else None
+
+        return ConferenceDetailForm(
+            conference=self.toConferenceForm(conf),
+            sessions=self.toConferenceSessionForms(
+                sessions, dict((k, speaker.displayName) for k, speaker in speakers.items())),
+            speakers=self.toSpeakerForms(speakers.values()),
+            isUserAttending=bool(prof and wsck in prof.conferenceKeysToAttend)
+        )
+
     @ndb.transactional()
     def _updateConferenceObject(self, request):
         user_id = self._getUser()
@@ -90,6 +219,10 @@ class ConferenceApiHelper(EntityHelper):
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
+            # the organizer name is kept in sync from the Profile and the seats
+            # from the seat shards, so neither is ever set directly
+            if field.name in ('organizerDisplayName', 'seatsAvailable'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -102,32 +235,111 @@ class ConferenceApiHelper(EntityHelper):
                 setattr(conf, field.name, data)
 
         conf.put()
-        return self.toConferenceForm(conf, getattr(self._getUserProfile(user_id), 'displayName'))
-
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
-
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
-
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-
-        return q
+        invalidate(conf.key)
+        searchindex.documentsWritten('conference', conf)
+        # a rename must reach the announcement; the set lives in its own entity group, so wait for the commit
+        ndb.get_context().call_on_commit(
+            lambda: announcements.seatsChanged(conf, seatcounter.seatsAvailable(conf.key.urlsafe(), cached=False)))
+        return self.toConferenceForm(conf)
+
+    def _fillOrganizerNames(self, confs):
+        """Set organizerDisplayName on conferences created before it was stored on the entity,
+        reading their organizers' profiles with one batched lookup"""
+        unnamed = [conf for conf in confs if not conf.organizerDisplayName]
+        if not unnamed:
+            return
+        user_ids = list(set(conf.organizerUserId for conf in unnamed))
+        profiles = ndb.get_multi([ndb.Key(Profile, user_id) for user_id in user_ids])
+        names = dict((user_id, profile.displayName) for user_id, profile in zip(user_ids, profiles) if profile)
+        for conf in unnamed:
+            conf.organizerDisplayName = names.get(conf.organizerUserId)
+
+    @staticmethod
+    def _updateOrganizerDisplayName(user_id, page_token=None):
+        """Copy the organizer's current display name onto one batch of their conferences,
+        queueing the next batch if there are more; used by the organizer name fan-out task"""
+        p_key = ndb.Key(Profile, user_id)
+        profile = p_key.get()
+        if not profile:
+            return
+
+        cursor = Cursor(urlsafe=page_token) if page_token else None
+        c_keys, next_cursor, more = Conference.query(ancestor=p_key).fetch_page(
+            FANOUT_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+        # the conferences share the organizer's entity group, so one transaction rereads the batch
+        # and only sets the name, keeping edits and seat syncs made since the query
+        @ndb.transactional()
+        def _rename():
+            stale = [conf for conf in ndb.get_multi(c_keys)
+                     if conf and conf.organizerDisplayName != profile.displayName]
+            for conf in stale:
+                conf.organizerDisplayName = profile.displayName
+            if stale:
+                ndb.put_multi(stale)
+                invalidate(*[conf.key for conf in stale])
+        if c_keys:
+            _rename()
+
+        if more and next_cursor:
+            taskqueue.add(params={'userId': user_id,
+                                  'pageToken': next_cursor.urlsafe()},
+                          url='/tasks/update_organizer_name'
+                          )
+
+    def _queryConferences(self, request):
+        """Run the submitted filters through the query planner, returning one page of
+        conferences in name order and the next page token."""
+        filters = self._formatFilters(request.filters)
+
+        try:
+            return queryplanner.run(filters, self._pageSize(request.pageSize), request.pageToken)
+        except queryplanner.ScanBudgetExceeded:
+            raise endpoints.BadRequestException(
+                "The query would read more than %d conferences. "
+                "Add an equality filter or narrow its ranges." % QUERY_SCAN_BUDGET)
+        except (ValueError, datastore_errors.BadValueError):
+            raise endpoints.BadRequestException("Invalid page token: %s" % request.pageToken)
+
+    def _fetchAll(self, query, **options):
+        """Run a query exactly once and return its results as a list that can be iterated repeatedly."""
+        options.setdefault('batch_size', QUERY_BATCH_SIZE)
+        return query.fetch(**options)
+
+    def _pageSize(self, page_size):
+        """Return the requested page size, defaulted and capped."""
+        if not page_size:
+            return DEFAULT_PAGE_SIZE
+        elif page_size < 0:
+            raise endpoints.BadRequestException("Page size must be a positive number.")
+        return min(page_size, MAX_PAGE_SIZE)
+
+    def _fetchPage(self, query, page_size=None, page_token=None):
+        """Fetch one page of results from a query, returning (results, nextPageToken)."""
+        page_size = self._pageSize(page_size)
+
+        try:
+            cursor = Cursor(urlsafe=page_token) if page_token else None
+            results, next_cursor, more = query.fetch_page(page_size, start_cursor=cursor)
+        except datastore_errors.BadArgumentError:
+            raise endpoints.BadRequestException("Invalid page token or a filter that cannot be paged.")
+        except datastore_errors.BadValueError:
+            raise endpoints.BadRequestException("Invalid page token: %s" % page_token)
+
+        next_token = next_cursor.urlsafe() if more and next_cursor else None
+        return results, next_token
+
+    def _fetchRequested(self, query, request):
+        """Fetch a single page of results when the request asks for one (pageSize or pageToken),
+        otherwise every result; returns (results, nextPageToken)"""
+        if request.pageSize or request.pageToken:
+            return self._fetchPage(query, request.pageSize, request.pageToken)
+        return self._fetchAll(query), None
 
     def _formatFilters(self, filters):
-        """Parse, check validity and format user supplied filters."""
+        """Parse, check validity and format user supplied filters. Any number of fields
+        may carry inequalities; the query planner evaluates those it cannot push down."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
@@ -138,22 +350,127 @@ class ConferenceApiHelper(EntityHelper):
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException("Invalid value for %s: %s" % (filtr["field"], filtr["value"]))
 
             formatted_filters.append(filtr)
 
-        return inequality_field, formatted_filters
+        return formatted_filters
+
+    def _formatSessionFilters(self, filters):
+        """Parse, check validity and format user supplied session filters
+        into (column, operator, value) filters for the session filter engine."""
+        formatted_filters = []
+
+        for f in filters:
+            try:
+                field = SESSION_FIELDS[f.field]
+                op = OPERATORS[f.operator]
+            except KeyError:
+                raise endpoints.BadRequestException("Filter contains invalid field or operator.")
+
+            if field == 'conference' and op not in ('=', '!='):
+                raise endpoints.BadRequestException("Conference can only be filtered on with EQ or NE.")
+
+            try:
+                if field == 'typeOfSession':
+                    value = sessionfilter.typeNumber(f.value.upper())
+                elif field == 'startTime':
+                    fmt = "%I:%M %p" if f.value.upper().endswith('M') else "%H:%M"
+                    start = datetime.strptime(f.value.upper(), fmt).time()
+                    value = start.hour * 60 + start.minute
+                elif field == 'duration':
+                    value = int(f.value)
+                elif field == 'date':
+                    value = datetime.strptime(f.value[:10], "%Y-%m-%d").date().toordinal()
+                else:
+                    value = f.value
+            except (AttributeError, TypeError, ValueError):
+                raise endpoints.BadRequestException("Invalid value for %s: %s" % (f.field, f.value))
+
+            formatted_filters.append((field, op, value))
+
+        return formatted_filters
+
+    def _pageKeys(self, wsks, page_size=None, page_token=None):
+        """Return one page of a list of websafe keys and the next page token (the offset of the page)"""
+        page_size = self._pageSize(page_size)
+        try:
+            offset = int(page_token or 0)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid page token: %s" % page_token)
+        if offset < 0:
+            raise endpoints.BadRequestException("Invalid page token: %s" % page_token)
+
+        next_token = str(offset + page_size) if offset + page_size < len(wsks) else None
+        return wsks[offset:offset + page_size], next_token
+
+    def _toSessionForms(self, wssks, page_size=None, page_token=None):
+        """Look up sessions by websafe key and map them to ConferenceSessionForms, paging through
+        the keys when a page size or token is given"""
+        next_token = None
+        if page_size or page_token:
+            wssks, next_token = self._pageKeys(wssks, page_size, page_token)
+
+        return ConferenceSessionForms(
+            items=[self.toConferenceSessionForm(sess) for sess in self._getEntities(wssks) if sess],
+            nextPageToken=next_token
+        )
+
+    def _searchConferences(self, request):
+        """Return the ConferenceForms of one page of the conferences matching a search query."""
+        if not request.query or not searchindex.tokenize(request.query):
+            raise endpoints.BadRequestException("Search 'query' field required")
+        wscks, next_token = self._pageKeys(
+            searchindex.search('conference', request.query), request.pageSize, request.pageToken)
+
+        confs = [conf for conf in self._getEntities(wscks) if conf]
+        self._fillOrganizerNames(confs)
+        return ConferenceForms(
+            items=self.toConferenceForms(confs),
+            nextPageToken=next_token
+        )
+
+    def _searchSessions(self, request):
+        """Return the ConferenceSessionForms of one page of the sessions matching a search query."""
+        if not request.query or not searchindex.tokenize(request.query):
+            raise endpoints.BadRequestException("Search 'query' field required")
+        wssks = searchindex.search('session', request.query)
+        return self._toSessionForms(wssks, request.pageSize or DEFAULT_PAGE_SIZE, request.pageToken)
 
     def _createConferenceSessionObject(self, request):
         """Create or update ConferenceSession object, returning ConferenceSessionForm/request."""
+        return self._createConferenceSessionObjectAsync(request).get_result()
+
+    @staticmethod
+    def _queueFeaturedSpeaker(speaker_key, wsck):
+        """Queue a refresh of a speaker's featured summary at a conference on the featured speaker
+        pull queue; refreshes of the same pair within FEATURED_SPEAKER_COUNTDOWN seconds are coalesced
+        into one, and one set speaker and sessions task consumes them all at the end of that window"""
+        window = int(time.time() / FEATURED_SPEAKER_COUNTDOWN)
+        pair = hashlib.md5('%s %s' % (speaker_key, wsck)).hexdigest()
+        try:
+            taskqueue.Queue(FEATURED_SPEAKER_QUEUE).add(
+                taskqueue.Task(name='featured-speaker-%s-%d' % (pair, window),
+                               payload=json.dumps([speaker_key, wsck]),
+                               method='PULL'))
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+        try:
+            taskqueue.add(name='set-speaker-and-sessions-%d' % window,
+                          countdown=FEATURED_SPEAKER_COUNTDOWN,
+                          url='/tasks/set_speaker_and_sessions'
+                          )
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+
+    @ndb.tasklet
+    def _createConferenceSessionObjectAsync(self, request):
+        """tasklet creating a ConferenceSession; the conference and speaker reads and the
+        session id allocation run in parallel, as do the session and speaker writes"""
         p_key = self._getUserProfileKey()
         if not request.name:
             raise endpoints.BadRequestException("Session 'name' field required")
@@ -179,89 +496,258 @@ class ConferenceApiHelper(EntityHelper):
         del data['websafeSessionKey']
         del data['speakerDisplayName']
 
-        conf = self._retrieveConference(request.websafeConferenceKey)
+        # get conference (and speaker) and allocate the session ID at the same time
+        wsck = request.websafeConferenceKey
+        conf_future = self._retrieveConferenceAsync(wsck)
+        ids_future = ConferenceSession.allocate_ids_async(size=1, parent=ndb.Key(urlsafe=wsck))
+        speaker_future = self._getEntityAsync(request.speakerUserId, 'speaker') if request.speakerUserId else None
+
+        conf = yield conf_future
 
         # check that user is also the conference creator
         if p_key != conf.key.parent():
             raise endpoints.UnauthorizedException(
                     'Only Conference Creator can also create session')
 
-        # check if session exists given websafeConfKey
-        # get conference; check that it exists
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                    'No conference found with key: %s' % wsck)
-
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
-        cs_id = ConferenceSession.allocate_ids(size=1, parent=conf.key)[0]
+        cs_id = (yield ids_future)[0]
         cs_key = ndb.Key(ConferenceSession, cs_id, parent=conf.key)
         data['key'] = cs_key
 
         speakerDisplayName = None
-        speaker = None
-        if request.speakerUserId:
-            speaker = self._getSpeaker(request.speakerUserId)
+        if speaker_future:
+            speaker = yield speaker_future
             data['speakerUserId'] = request.speakerUserId
             speakerDisplayName = speaker.displayName
 
-        # create ConferenceSession, send email to organizer confirming
-        # creation of ConferenceSession & return (modified) ConferenceSessionForm
-        ConferenceSession(**data).put()
+        # create ConferenceSession (and add it to the Speaker's index of sessions in the
+        # same transaction) & return (modified) ConferenceSessionForm
+        conf_sess = ConferenceSession(**data)
+        if speaker_future:
+            yield self._putSpeakerSessionAsync(conf_sess)
+        else:
+            yield conf_sess.put_async()
+        sessionfilter.sessionsWritten(conf_sess)
+        searchindex.documentsWritten('session', conf_sess)
+        responsecache.bump(responsecache.SESSIONS, responsecache.conferenceScope(wsck))
+
+        # queue a refresh of the speaker's featured summary, if the session has a speaker
+        if speaker_future:
+            self._queueFeaturedSpeaker(request.speakerUserId, wsck)
+
+        raise ndb.Return(self.toConferenceSessionForm(conf_sess, speakerDisplayName))
+
+    @ndb.transactional_tasklet(xg=True)
+    def _putSpeakerSessionAsync(self, conf_sess):
+        """transactional tasklet writing a session and adding it to its speaker's
+        sessionKeysToSpeakAt, the index that speaker-centric reads look sessions up in"""
+        speaker = yield ndb.Key(urlsafe=conf_sess.speakerUserId).get_async()
+        wssk = conf_sess.key.urlsafe()
+
+        # check if speaker already scheduled to speak at this session
+        if wssk in speaker.sessionKeysToSpeakAt:
+            raise ConflictException(
+                    "They are already set to speak for this conference")
+        speaker.sessionKeysToSpeakAt.append(wssk)
+
+        yield conf_sess.put_async(), speaker.put_async()
+        invalidate(speaker.key)
+        responsecache.bump(responsecache.SPEAKERS)
 
-        if speaker:
-            wssk = cs_key.urlsafe()
-            # check if speaker already scheduled to speak at this session
-            if wssk in speaker.sessionKeysToSpeakAt:
-                raise ConflictException(
-                        "They are already set to speak for this conference")
-
-            speaker.sessionKeysToSpeakAt.append(wssk)
-            speaker.put()
-        # add speaker name and their sessions task to queue
-        taskqueue.add(params={'speakerId': request.speakerUserId,
-                              'confId': conf.key.urlsafe()},
-                      url='/tasks/set_speaker_and_sessions'
-                      )
-        conf_sess = ndb.Key(urlsafe=cs_key.urlsafe()).get()
+    @ndb.transactional(xg=True)
+    def _deleteConferenceSessionObject(self, wssk):
+        """Delete a session and remove it from its speaker's sessionKeysToSpeakAt"""
+        sess = ndb.Key(urlsafe=wssk).get()
+        if not sess:
+            raise endpoints.NotFoundException('No session found with key: %s' % wssk)
 
-        return self.toConferenceSessionForm(conf_sess, speakerDisplayName)
+        sess.key.delete()
+        invalidate(sess.key)
+        sessionfilter.sessionsDeleted(sess.key)
+        searchindex.documentsDeleted('session', sess.key)
+        responsecache.bump(responsecache.SESSIONS, responsecache.conferenceScope(sess.key.parent().urlsafe()))
+
+        if sess.speakerUserId:
+            speaker = ndb.Key(urlsafe=sess.speakerUserId).get()
+            if speaker and wssk in speaker.sessionKeysToSpeakAt:
+                speaker.sessionKeysToSpeakAt.remove(wssk)
+                speaker.put()
+                invalidate(speaker.key)
+                responsecache.bump(responsecache.SPEAKERS)
+
+    @staticmethod
+    def _getSpeakerSessions(speaker, conf_key=None, cached=True):
+        """Return the sessions a speaker is set to speak at (optionally only those of one
+        conference), read from the speaker's sessionKeysToSpeakAt with one batched lookup;
+        sessions about to be written are read with cached=False, straight from the datastore"""
+        wssks = speaker.sessionKeysToSpeakAt
+        if conf_key:
+            # sessions are children of their conference, so the key alone tells which it is
+            wssks = [wssk for wssk in wssks if ndb.Key(urlsafe=wssk).parent() == conf_key]
+        if cached:
+            sessions = entitycache.getEntities(wssks)
+        else:
+            sessions = ndb.get_multi([ndb.Key(urlsafe=wssk) for wssk in wssks])
+        speaker_key = speaker.key.urlsafe()
+        return [sess for sess in sessions if sess and sess.speakerUserId == speaker_key]
+
+    def _detachSpeaker(self, speaker):
+        """Remove the speaker from every session they are set to speak at; small sets are
+        written in batches right away, larger ones are handed to the detach speaker task"""
+        if len(speaker.sessionKeysToSpeakAt) > SPEAKER_DETACH_INLINE_LIMIT:
+            taskqueue.add(params={'websafeSpeakerKey': speaker.key.urlsafe()},
+                          url='/tasks/detach_speaker'
+                          )
+        else:
+            # the sessions are written back whole, so they must not be cached (possibly stale) copies
+            self._clearSessionSpeakers(self._getSpeakerSessions(speaker, cached=False))
+
+    @staticmethod
+    def _clearSessionSpeakers(sessions):
+        """Unset the speaker of the given sessions, writing them with chunked put_multi calls"""
+        for session in sessions:
+            session.speakerUserId = None
+        for i in range(0, len(sessions), PUT_BATCH_SIZE):
+            ndb.put_multi(sessions[i:i + PUT_BATCH_SIZE])
+        if sessions:
+            invalidate(*[session.key for session in sessions])
+            responsecache.bump(responsecache.SESSIONS, *set(
+                responsecache.conferenceScope(session.key.parent().urlsafe()) for session in sessions))
+
+    @staticmethod
+    def _queueSpeakerChecks():
+        """Queue a consistency check of every speaker's sessionKeysToSpeakAt; used by the cron job"""
+        queue = taskqueue.Queue()
+        tasks = []
+        for speaker_key in Speaker.query().iter(keys_only=True, batch_size=QUERY_BATCH_SIZE):
+            tasks.append(taskqueue.Task(params={'websafeSpeakerKey': speaker_key.urlsafe()},
+                                        url='/tasks/check_speaker_sessions'))
+            # the task queue accepts at most 100 tasks per call
+            if len(tasks) == 100:
+                queue.add(tasks)
+                tasks = []
+        if tasks:
+            queue.add(tasks)
+
+    @staticmethod
+    def _repairSpeakerSessions(wssk):
+        """Bring a speaker's sessionKeysToSpeakAt back in line with the sessions that name them;
+        used by the speaker sessions consistency check task"""
+        # the query may lag behind recent writes, so only trust what a get confirms
+        candidates = [k.urlsafe() for k in
+                      ConferenceSession.query(ConferenceSession.speakerUserId == wssk).fetch(keys_only=True)]
+
+        speaker = ndb.Key(urlsafe=wssk).get()
+        if not speaker:
+            return
+        wssks = list(speaker.sessionKeysToSpeakAt)
+        wssks.extend(k for k in candidates if k not in wssks)
+        # sessions belong to as many entity groups as conferences, more than a transaction may
+        # touch, so they are checked beforehand and the transaction only rewrites the speaker
+        sessions = ndb.get_multi([ndb.Key(urlsafe=k) for k in wssks])
+        confirmed = dict((k, bool(sess and sess.speakerUserId == wssk)) for k, sess in zip(wssks, sessions))
+
+        @ndb.transactional()
+        def _repair():
+            speaker = ndb.Key(urlsafe=wssk).get()
+            if not speaker:
+                return
+            # sessions added to the index since the check are left as they are
+            actual = [k for k in speaker.sessionKeysToSpeakAt if confirmed.get(k, True)]
+            actual.extend(k for k in wssks if confirmed[k] and k not in actual)
+
+            if actual != speaker.sessionKeysToSpeakAt:
+                logging.warning('Repaired the session index of speaker %s: %s -> %s',
+                                wssk, speaker.sessionKeysToSpeakAt, actual)
+                speaker.sessionKeysToSpeakAt = actual
+                speaker.put()
+                invalidate(speaker.key)
+                responsecache.bump(responsecache.SPEAKERS)
+        _repair()
+
+    @staticmethod
+    def _detachSpeakerSessions(wssk):
+        """Detach one batch of sessions from a removed speaker, queueing another task
+        while any remain; used by the detach speaker task"""
+        sessions = ConferenceSession.query(ConferenceSession.speakerUserId == wssk)\
+            .fetch(PUT_BATCH_SIZE)
+        ConferenceApiHelper._clearSessionSpeakers(sessions)
+
+        # detached sessions drop out of the query, so the next batch starts from the top
+        if len(sessions) == PUT_BATCH_SIZE:
+            taskqueue.add(params={'websafeSpeakerKey': wssk},
+                          url='/tasks/detach_speaker'
+                          )
 
     def _createWishlistObject(self, request):
         """Create or update Wishlist object, returning WishlistForm/request."""
+        return self._createWishlistObjectAsync(request).get_result()
+
+    @ndb.tasklet
+    def _createWishlistObjectAsync(self, request):
+        """tasklet adding a session to the user's Wishlist; the session and wishlist
+        lookups run in parallel"""
         user_id = self._getUser()
         p_key = self._getUserProfileKey(user_id)
 
+        # Check the session exists and look for an existing wishlist at the same time
         wssk = request.websafeSessionKey
-        sess = ndb.Key(urlsafe=wssk).get()
-        if not sess:
-            raise endpoints.NotFoundException('No session found with key: %s' % wssk)
-
-        w = {}
-
-        # Create a unique key
-        w_id = Wishlist.allocate_ids(size=1, parent=p_key)[0]
-        w_key = ndb.Key(Wishlist, w_id, parent=p_key)
-        w['key'] = w_key
-
-        # Check for an existing wishlist
-        wish = Wishlist.query(ancestor=p_key).get()
+        sess, wish = yield self._retrieveSessionAsync(wssk), Wishlist.query(ancestor=p_key).get_async()
 
         # If there is already a wishlist record, append this session to it,
         # otherwise create a new wishlist (unless its already in the wishlist)
         if not wish:
-            w['sessions'] = [wssk]
-            Wishlist(**w).put()
+            # Create a unique key
+            w_id = (yield Wishlist.allocate_ids_async(size=1, parent=p_key))[0]
+            wish = Wishlist(key=ndb.Key(Wishlist, w_id, parent=p_key), sessions=[wssk])
         elif wssk in wish.sessions:
             raise ConflictException("You have already placed this session in your wishlist")
         else:
             wish.sessions.append(wssk)
+        yield wish.put_async()
+
+        hydrated = yield self._hydrateWishlistAsync(wish)
+        raise ndb.Return(self.toWishlistForm(hydrated))
+
+    def _hydrateWishlist(self, wish):
+        """Load the sessions of a wishlist and their speaker names with one batched lookup each;
+        stale session keys are left out and pruned from the wishlist in the background."""
+        return self._hydrateWishlistAsync(wish).get_result()
+
+    @ndb.tasklet
+    def _hydrateWishlistAsync(self, wish):
+        """tasklet version of _hydrateWishlist"""
+        wssks = [wssk for wssk in wish.sessions if wssk]
+        sessions = yield self._getEntitiesAsync(wssks)
+
+        stale = [wssk for wssk, sess in zip(wssks, sessions) if not sess]
+        if stale:
+            taskqueue.add(params={'websafeWishlistKey': wish.key.urlsafe(),
+                                  'sessionKeys': stale},
+                          url='/tasks/prune_wishlist'
+                          )
+
+        sessions = [sess for sess in sessions if sess]
+        speakers = yield self._getSpeakersAsync([sess.speakerUserId for sess in sessions], bail=False)
+
+        raise ndb.Return({
+            'key': wish.key,
+            'sessions': sessions,
+            'speakerNames': dict((k, speaker.displayName) for k, speaker in speakers.items())
+        })
+
+    @staticmethod
+    @ndb.transactional()
+    def _pruneWishlist(wish_key, session_keys):
+        """Remove stale session keys from a wishlist; used by the prune wishlist task"""
+        wish = ndb.Key(urlsafe=wish_key).get()
+        if not wish:
+            return
+        remaining = [wssk for wssk in wish.sessions if wssk not in session_keys]
+        if len(remaining) != len(wish.sessions):
+            wish.sessions = remaining
             wish.put()
-            w['sessions'] = [self._retrieveSession(cs_id) for cs_id in wish.sessions]
-
-        return self.toWishlistForm(w)
 
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
@@ -270,6 +756,7 @@ class ConferenceApiHelper(EntityHelper):
 
         # if saveProfile(), process user-modifiable fields
         if save_request:
+            displayName = prof.displayName
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
@@ -277,6 +764,12 @@ class ConferenceApiHelper(EntityHelper):
                         setattr(prof, field, str(val))
             prof.put()
 
+            # copy a new display name onto every conference this user organizes
+            if prof.displayName != displayName:
+                taskqueue.add(params={'userId': prof.key.id()},
+                              url='/tasks/update_organizer_name'
+                              )
+
         # return ProfileForm
         return self.toProfileForm(prof)
 
@@ -290,22 +783,49 @@ class ConferenceApiHelper(EntityHelper):
         s_key = ndb.Key(Speaker, s_id)
         speaker['key'] = s_key
         Speaker(**speaker).put()
+        responsecache.bump(responsecache.SPEAKERS)
 
         return self.toSpeakerForm(request, None, s_key.urlsafe())
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = False
-        prof = self._getProfileFromUser()  # get user Profile
+        # get user Profile and check if conf exists given websafeConfKey, in parallel
+        prof_future = self._getProfileFromUserAsync()
+        conf_future = self._retrieveConferenceAsync(request.websafeConferenceKey)
+        prof = prof_future.get_result()
+        conf = conf_future.get_result()
+
+        return BooleanMessage(data=self._registerProfile(prof.key, conf, reg))
+
+    def _registerProfile(self, p_key, conf, reg=True):
+        """Register (or unregister) a profile for a conference through its seat shards;
+        returns whether the registration changed"""
+        wsck = conf.key.urlsafe()
+        shards = seatcounter.getShards(conf)
+
+        # take a seat from (or give one back to) a random shard; when registering,
+        # retry with another shard if the one picked has sold out in the meantime
+        retval = None
+        while retval is None:
+            shard_key = seatcounter.pickShard(shards, free=reg)
+            if not shard_key:
+                raise ConflictException(
+                        "There are no seats available.")
+            retval = self._moveSeat(p_key, wsck, shard_key, reg)
+            shards = [shard for shard in shards if shard.key != shard_key]
 
-        # check if conf exists gven websafeConfKey
-        # get conference; check that it exists
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                    'No conference found with key: %s' % wsck)
+        if retval:
+            seatcounter.seatsChanged(wsck)
+            # a crossing of the nearly sold out range must be seen, so read the shards themselves
+            announcements.seatsChanged(conf, seatcounter.seatsAvailable(wsck, cached=False))
+
+        return retval
+
+    @ndb.transactional(xg=True)
+    def _moveSeat(self, p_key, wsck, shard_key, reg=True):
+        """Register (or unregister) the user and take a seat from (or give one back to) a seat shard;
+        returns None when registering and the shard has no seats left"""
+        prof, shard = ndb.get_multi([p_key, shard_key])
 
         # register
         if reg:
@@ -315,27 +835,23 @@ class ConferenceApiHelper(EntityHelper):
                         "You have already registered for this conference")
 
             # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                        "There are no seats available.")
+            if shard.seatsAvailable <= 0:
+                return None
 
             # register user, take away one seat
             prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+            shard.seatsAvailable -= 1
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if wsck not in prof.conferenceKeysToAttend:
+                return False
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
+            # unregister user, add back one seat
+            prof.conferenceKeysToAttend.remove(wsck)
+            shard.seatsAvailable += 1
 
         # write things back to the datastore & return
-        prof.put()
-        conf.put()
-
-        return BooleanMessage(data=retval)
+        ndb.put_multi([prof, shard])
+        return True
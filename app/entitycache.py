@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+"""
+entitycache.py -- read-through cache for entities looked up by their websafe key
+
+Lookups try a per-request dict, then an in-process LRU whose entries expire
+after a TTL, then memcache, and only then the datastore. Writers call
+invalidate() with the keys they put or delete; the in-process tier of other
+instances is only bounded by its TTL.
+
+invalidate() leaves a lock marker in memcache instead of deleting the entry,
+and a reader only fills memcache with add(), so a reader that read the
+datastore before a write committed can never cache its copy over the write:
+its add() fails on the marker, which expires after MEMCACHE_ENTITY_LOCK_SECONDS.
+"""
+
+import collections
+import os
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import ndb
+
+from settings import ENTITY_CACHE_SIZE
+from settings import ENTITY_CACHE_TTL
+from settings import MEMCACHE_ENTITY_LOCK_SECONDS
+from settings import MEMCACHE_ENTITY_PREFIX
+from settings import MEMCACHE_ENTITY_TTL
+
+
+# hits per tier ('request', 'process', 'memcache') and misses
+STATS = collections.Counter()
+
+# memcache value of an entity invalidated less than MEMCACHE_ENTITY_LOCK_SECONDS ago
+_LOCKED = 0
+
+_adapter = ndb.ModelAdapter()
+_local = threading.local()
+
+
+class _LruCache(object):
+    """Thread-safe least-recently-used cache whose entries expire after ttl seconds"""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.time():
+                return None
+            # re-insert so that the entry becomes the most recently used
+            self._items[key] = item
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (time.time() + self.ttl, value)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+_lru = _LruCache(ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL)
+
+
+def _requestCache():
+    """Return the dict of entities already read while serving the current request"""
+    request_id = os.environ.get('REQUEST_LOG_ID')
+    if getattr(_local, 'request_id', None) != request_id or not hasattr(_local, 'entities'):
+        _local.request_id = request_id
+        _local.entities = {}
+    return _local.entities
+
+
+def _encode(entity):
+    return _adapter.entity_to_pb(entity).Encode()
+
+
+def _decode(data):
+    return _adapter.pb_to_entity(entity_pb.EntityProto(data))
+
+
+@ndb.tasklet
+def getEntitiesAsync(urlsafe_keys):
+    """Tasklet returning the entities for the given websafe keys (None where not found),
+    reading each tier of the cache before the datastore. The memcache and datastore
+    lookups go through the ndb context, so they are batched with (and overlap) the
+    other RPCs of concurrently running tasklets."""
+    # transactions must see the datastore itself, never a cached copy
+    if ndb.in_transaction():
+        entities = yield ndb.get_multi_async([ndb.Key(urlsafe=k) for k in urlsafe_keys])
+        raise ndb.Return(entities)
+
+    local = _requestCache()
+    found = {}
+    encoded = {}
+
+    for k in urlsafe_keys:
+        if k in local:
+            STATS['request'] += 1
+            found[k] = local[k]
+        elif k not in encoded:
+            data = _lru.get(k)
+            if data is not None:
+                STATS['process'] += 1
+                encoded[k] = data
+
+    ctx = ndb.get_context()
+    missing = [k for k in set(urlsafe_keys) if k not in found and k not in encoded]
+    if missing:
+        cached = yield [ctx.memcache_get(MEMCACHE_ENTITY_PREFIX + k) for k in missing]
+        for k, data in zip(missing, cached):
+            if data is not None and data != _LOCKED:
+                STATS['memcache'] += 1
+                _lru.set(k, data)
+                encoded[k] = data
+        missing = [k for k in missing if k not in encoded]
+
+    if missing:
+        STATS['miss'] += len(missing)
+        entities = yield ndb.get_multi_async([ndb.Key(urlsafe=k) for k in missing])
+        fills = []
+        for k, entity in zip(missing, entities):
+            if entity:
+                found[k] = entity
+                fills.append((k, _encode(entity)))
+        # add() fails on a lock marker, i.e. when the entity was written since it was read
+        added = yield [ctx.memcache_add(MEMCACHE_ENTITY_PREFIX + k, data, time=MEMCACHE_ENTITY_TTL)
+                       for k, data in fills]
+        for (k, data), ok in zip(fills, added):
+            if ok:
+                _lru.set(k, data)
+
+    for k, data in encoded.items():
+        found[k] = _decode(data)
+    local.update(found)
+
+    raise ndb.Return([found.get(k) for k in urlsafe_keys])
+
+
+def getEntities(urlsafe_keys):
+    """Return the entities for the given websafe keys (None where not found)"""
+    return getEntitiesAsync(urlsafe_keys).get_result()
+
+
+def getEntity(urlsafe_key):
+    """Return the entity for a websafe key, or None if it does not exist"""
+    return getEntities([urlsafe_key])[0]
+
+
+def invalidate(*keys):
+    """Drop the given entity keys (ndb.Key or websafe strings) from every tier of the cache;
+    inside a transaction this happens once it has committed"""
+    urlsafe_keys = [k.urlsafe() if isinstance(k, ndb.Key) else k for k in keys]
+
+    def _invalidate():
+        local = _requestCache()
+        for k in urlsafe_keys:
+            local.pop(k, None)
+            _lru.delete(k)
+        memcache.set_multi(dict((k, _LOCKED) for k in urlsafe_keys),
+                           time=MEMCACHE_ENTITY_LOCK_SECONDS, key_prefix=MEMCACHE_ENTITY_PREFIX)
+
+    ndb.get_context().call_on_commit(_invalidate)
@@ -7,6 +7,7 @@ from google.appengine.ext import ndb
 from models import Profile
 from models import TeeShirtSize
 
+import entitycache
 from utils import getUserId
 from mapper import FormMapper
 
@@ -14,22 +15,60 @@ from mapper import FormMapper
 class EntityHelper(FormMapper):
     """Helper class that performs repetitive parsing operations to abstract it away to the conference.py"""
 
-    def _getEntity(self, key, entity_type="entity"):
-        """gets an entity by its unique key; bail if not found"""
-        entity = ndb.Key(urlsafe=key).get()
-        if not entity:
+    @ndb.tasklet
+    def _getEntityAsync(self, key, entity_type="entity"):
+        """tasklet getting an entity by its unique key; bail if not found"""
+        entities = yield entitycache.getEntitiesAsync([key])
+        if not entities[0]:
             raise endpoints.NotFoundException(
                 'No %s found with key: %s' % (entity_type, key))
-        return entity
+        raise ndb.Return(entities[0])
+
+    def _getEntity(self, key, entity_type="entity"):
+        """gets an entity by its unique key; bail if not found"""
+        return self._getEntityAsync(key, entity_type).get_result()
         
     def _getSpeaker(self, key):
         """get Speaker object from request; bail if not found"""
         return self._getEntity(key, 'speaker')
 
+    def _getEntitiesAsync(self, keys):
+        """tasklet getting entities for many unique keys with one batched lookup; None for keys not found"""
+        return entitycache.getEntitiesAsync(keys)
+
+    def _getEntities(self, keys):
+        """gets entities for many unique keys with one batched lookup; None for keys not found"""
+        return entitycache.getEntities(keys)
+
+    @ndb.tasklet
+    def _getSpeakersAsync(self, keys, bail=True):
+        """tasklet getting Speaker objects for many keys with one batched lookup, returned as a dict by key;
+        bail listing every key not found (or leave them out of the dict)"""
+        keys = list(set(k for k in keys if k))
+        speakers = yield entitycache.getEntitiesAsync(keys)
+        missing = [k for k, speaker in zip(keys, speakers) if not speaker]
+        if missing and bail:
+            raise endpoints.NotFoundException(
+                'No speaker found with key(s): %s' % ', '.join(missing))
+        raise ndb.Return(dict((k, speaker) for k, speaker in zip(keys, speakers) if speaker))
+
+    def _getSpeakers(self, keys, bail=True):
+        """get Speaker objects for many keys with one batched lookup, returned as a dict by key;
+        bail listing every key not found (or leave them out of the dict)"""
+        return self._getSpeakersAsync(keys, bail).get_result()
+
+    def _retrieveConferenceAsync(self, key):
+        """tasklet getting Conference object from request; bail if not found"""
+        return self._getEntityAsync(key, 'conference')
+
     def _retrieveConference(self, key):
         """get Conference object from request; bail if not found"""
         return self._getEntity(key, 'conference')
 
+    def _retrieveSessionAsync(self, key):
+        """tasklet getting Session object from request; bail if not found"""
+        return self._getEntityAsync(key, 'session')
+
     def _retrieveSession(self, key):
         """get Session object from request; bail if not found"""
         return self._getEntity(key, 'session')
@@ -51,11 +90,12 @@ class EntityHelper(FormMapper):
         """Get the user Profile from datastore"""
         return self._getUserProfileKey(user_id).get()
         
-    def _getProfileFromUser(self):
-        """Return user Profile from datastore, creating new one if non-existent."""
+    @ndb.tasklet
+    def _getProfileFromUserAsync(self):
+        """tasklet returning user Profile from datastore, creating new one if non-existent."""
         # get Profile from datastore
         p_key = self._getUserProfileKey()
-        profile = p_key.get()
+        profile = yield p_key.get_async()
         # create new Profile if not there
         if not profile:
             user = endpoints.get_current_user()
@@ -65,6 +105,10 @@ class EntityHelper(FormMapper):
                 mainEmail=user.email(),
                 teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
+            yield profile.put_async()
+
+        raise ndb.Return(profile)
 
-        return profile
+    def _getProfileFromUser(self):
+        """Return user Profile from datastore, creating new one if non-existent."""
+        return self._getProfileFromUserAsync().get_result()
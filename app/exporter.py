@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""
+exporter.py -- bulk export of whole kinds as newline-delimited JSON or CSV
+
+An export is read one page at a time with a query cursor: every export request
+returns a single page together with the cursor of the next one, which the client
+passes back to get the following page. A request thus costs one page of memory
+and time, however large the kind is.
+"""
+
+import csv
+import StringIO
+
+from google.appengine.datastore.datastore_query import Cursor
+from protorpc import protojson
+
+from models import ConferenceSession
+from models import Profile
+from models import Speaker
+
+from mapper import FormMapper
+
+from settings import EXPORT_BATCH_SIZE
+
+
+_mapper = FormMapper()
+
+# export name -> (model class, function mapping an entity to its outbound form)
+EXPORTS = {
+    'sessions': (ConferenceSession, _mapper.toConferenceSessionForm),
+    'profiles': (Profile, _mapper.toProfileForm),
+    'speakers': (Speaker, _mapper.toSpeakerForm),
+}
+
+CONTENT_TYPES = {
+    'json': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _csvValue(value):
+    """Format a form field value for a CSV cell; repeated values are joined with '|'"""
+    if isinstance(value, list):
+        return '|'.join(_csvValue(v) for v in value)
+    if value is None:
+        return ''
+    return unicode(value).encode('utf-8')
+
+
+def exportPage(name, fmt='json', page_token=None):
+    """Return the export of one page of the entities of a kind, and the token of the next
+    page (None after the last one); a CSV export starts with a header row on its first page"""
+    model, toForm = EXPORTS[name]
+    cursor = Cursor(urlsafe=page_token) if page_token else None
+    entities, cursor, more = model.query().fetch_page(EXPORT_BATCH_SIZE, start_cursor=cursor)
+    forms = [toForm(entity) for entity in entities]
+
+    out = StringIO.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        if not page_token and forms:
+            writer.writerow([field.name for field in forms[0].all_fields()])
+        for form in forms:
+            writer.writerow([_csvValue(getattr(form, field.name)) for field in form.all_fields()])
+    else:
+        for form in forms:
+            out.write(protojson.encode_message(form))
+            out.write('\n')
+
+    return out.getvalue(), cursor.urlsafe() if more and cursor else None
@@ -1,21 +1,141 @@
 #!/usr/bin/env python
 
+import json
+import urllib
+
 import webapp2
 from google.appengine.api import app_identity
+from google.appengine.api import datastore_errors
 from google.appengine.api import mail
+from google.appengine.api import taskqueue
 from conference import ConferenceApi
+import cacheaside
+import entitycache
+import exporter
+import queryplanner
+import rpcstats
+import seatcounter
+
+from settings import FEATURED_SPEAKER_QUEUE
+from settings import FEATURED_SPEAKER_LEASE_SECONDS
+from settings import FEATURED_SPEAKER_BATCH_SIZE
 
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
-        """Set Announcement in Memcache."""
+        """Reconcile the nearly sold out conferences and set Announcement in Memcache."""
         ConferenceApi._cacheAnnouncement()
 
 
+class ExportHandler(webapp2.RequestHandler):
+    def get(self, name):
+        """Export one page of the sessions, profiles or speakers as newline-delimited JSON or CSV;
+        the X-Next-Page-Token header (and Link header) tell how to get the next page."""
+        fmt = self.request.get('format', 'json')
+        if fmt not in exporter.CONTENT_TYPES:
+            self.abort(400, detail='Unsupported export format: %s' % fmt)
+
+        page_token = self.request.get('pageToken') or None
+        try:
+            page, next_token = exporter.exportPage(name, fmt, page_token)
+        except datastore_errors.BadValueError:
+            self.abort(400, detail='Invalid page token')
+
+        self.response.content_type = exporter.CONTENT_TYPES[fmt]
+        self.response.headers['Content-Disposition'] = 'attachment; filename=%s.%s' % (name, fmt)
+        if next_token:
+            self.response.headers['X-Next-Page-Token'] = next_token
+            self.response.headers['Link'] = '<%s?%s>; rel="next"' % (
+                self.request.path, urllib.urlencode({'format': fmt, 'pageToken': next_token}))
+        self.response.write(page)
+
+
+class StatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return the endpoint statistics of every instance (as last flushed to memcache), and this
+        instance's endpoint, entity cache and query plan statistics, as JSON."""
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps({
+            'endpoints': rpcstats.globalSnapshot(),
+            'instanceEndpoints': rpcstats.snapshot(),
+            'entityCache': dict(entitycache.STATS),
+            'queryPlans': dict((plan, dict(zip(('queries', 'scanned', 'returned'), totals)))
+                               for plan, totals in queryplanner.PLAN_STATS.items()),
+        }, indent=2, sort_keys=True))
+
+
 class SetSpeakerAndSessions(webapp2.RequestHandler):
     def post(self):
-        """Set speaker and their sessions in Memcache."""
-        ConferenceApi._cacheSpeakerAndSession(self.request.get('speakerId'), self.request.get('confId'))
+        """Set the speakers and their sessions queued on the featured speaker pull queue in
+        Memcache, leasing up to FEATURED_SPEAKER_BATCH_SIZE refreshes at a time."""
+        queue = taskqueue.Queue(FEATURED_SPEAKER_QUEUE)
+        while True:
+            tasks = queue.lease_tasks(FEATURED_SPEAKER_LEASE_SECONDS, FEATURED_SPEAKER_BATCH_SIZE)
+            if not tasks:
+                break
+            try:
+                for speaker_key, wsck in set(tuple(json.loads(task.payload)) for task in tasks):
+                    ConferenceApi._cacheSpeakerAndSession(speaker_key, wsck)
+            except Exception:
+                # hand the refreshes back right away so the retry of this task finds them
+                for task in tasks:
+                    queue.modify_task_lease(task, 0)
+                raise
+            queue.delete_tasks(tasks)
+            if len(tasks) < FEATURED_SPEAKER_BATCH_SIZE:
+                break
+
+
+class PruneWishlistHandler(webapp2.RequestHandler):
+    def post(self):
+        """Remove stale session keys from a wishlist."""
+        ConferenceApi._pruneWishlist(self.request.get('websafeWishlistKey'),
+                                     self.request.get_all('sessionKeys'))
+
+
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy an organizer's display name onto their conferences."""
+        ConferenceApi._updateOrganizerDisplayName(self.request.get('userId'),
+                                                  self.request.get('pageToken'))
+
+
+class DeleteConferenceHandler(webapp2.RequestHandler):
+    def post(self):
+        """Remove the sessions and registrations of a deleted conference, one batch per task."""
+        ConferenceApi._cascadeConferenceDelete(self.request.get('websafeConferenceKey'),
+                                               self.request.get('stage'),
+                                               self.request.get('pageToken'))
+
+
+class DetachSpeakerHandler(webapp2.RequestHandler):
+    def post(self):
+        """Detach a removed speaker from their sessions."""
+        ConferenceApi._detachSpeakerSessions(self.request.get('websafeSpeakerKey'))
+
+
+class SyncSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy the total of a conference's seat shards onto the Conference."""
+        seatcounter.syncConference(self.request.get('websafeConferenceKey'))
+
+
+class CheckSpeakerSessionsCronHandler(webapp2.RequestHandler):
+    def get(self):
+        """Queue a consistency check of every speaker's session index."""
+        ConferenceApi._queueSpeakerChecks()
+
+
+class CheckSpeakerSessionsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Repair a speaker's session index if it drifted from their sessions."""
+        ConferenceApi._repairSpeakerSessions(self.request.get('websafeSpeakerKey'))
+
+
+class RefreshCacheHandler(webapp2.RequestHandler):
+    def post(self):
+        """Recompute a stale cached value in the background."""
+        cacheaside.refresh(self.request.get('name'), self.request.get('arg'))
 
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
@@ -33,7 +153,17 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
 
 
 app = webapp2.WSGIApplication([
+    (r'/export/(sessions|profiles|speakers)', ExportHandler),
+    ('/admin/stats', StatsHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/check_speaker_sessions', CheckSpeakerSessionsCronHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
-    ('/tasks/set_speaker_and_sessions', SetSpeakerAndSessions)
+    ('/tasks/set_speaker_and_sessions', SetSpeakerAndSessions),
+    ('/tasks/prune_wishlist', PruneWishlistHandler),
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/delete_conference', DeleteConferenceHandler),
+    ('/tasks/detach_speaker', DetachSpeakerHandler),
+    ('/tasks/sync_seats', SyncSeatsHandler),
+    ('/tasks/check_speaker_sessions', CheckSpeakerSessionsHandler),
+    ('/tasks/refresh_cache', RefreshCacheHandler)
 ], debug=True)
@@ -1,14 +1,84 @@
 #!/usr/bin/env python
 
+import operator
+
+from google.appengine.ext import ndb
+
+from models import Profile
 from models import ProfileForm
+from models import Speaker
 from models import SpeakerForm
+from models import Conference
 from models import ConferenceForm
+from models import ConferenceSession
 from models import ConferenceSessionForm
 from models import WishlistForm
 from models import SessionType
 from models import TeeShirtSize
 
 
+def _dateString(name):
+    """Return a getter converting a Date property to its string"""
+    def get(entity):
+        value = getattr(entity, name)
+        return str(value) if value is not None else None
+    return get
+
+
+def _timeString(name):
+    """Return a getter converting a Time property to its string"""
+    def get(entity):
+        value = getattr(entity, name)
+        return value.strftime("%H:%M %p") if value is not None else None
+    return get
+
+
+def _enumValue(name, enum):
+    """Return a getter converting a string property to the enum value of that name"""
+    values = dict((value_name, enum.lookup_by_name(value_name)) for value_name in enum.names())
+
+    def get(entity):
+        return values.get(getattr(entity, name))
+    return get
+
+
+def _copyPlan(model, form, converters=None):
+    """Work out once which form fields are copied from which model property and how:
+    (field name, getter) for every field the model also has"""
+    converters = converters or {}
+    return [(field.name, converters.get(field.name) or operator.attrgetter(field.name))
+            for field in form.all_fields() if field.name in model._properties]
+
+
+def _applyPlan(plan, source, form):
+    """Copy the fields of a plan from an entity (or message) onto a form; properties left
+    out of a projection query are left unset"""
+    for name, get in plan:
+        try:
+            value = get(source)
+        except ndb.UnprojectedPropertyError:
+            continue
+        setattr(form, name, value)
+
+
+CONFERENCE_PLAN = _copyPlan(Conference, ConferenceForm, {
+    'startDate': _dateString('startDate'),
+    'endDate': _dateString('endDate'),
+})
+
+SESSION_PLAN = _copyPlan(ConferenceSession, ConferenceSessionForm, {
+    'date': _dateString('date'),
+    'startTime': _timeString('startTime'),
+    'typeOfSession': _enumValue('typeOfSession', SessionType),
+})
+
+PROFILE_PLAN = _copyPlan(Profile, ProfileForm, {
+    'teeShirtSize': _enumValue('teeShirtSize', TeeShirtSize),
+})
+
+SPEAKER_PLAN = _copyPlan(Speaker, SpeakerForm)
+
+
 class FormMapper(object):
     """Helper class that converts ndb objects into Forms returned to the API endpoint caller"""
 
@@ -16,75 +86,68 @@ class FormMapper(object):
         """Copy relevant fields from Conference to ConferenceForm."""
         cf = ConferenceForm()
         if conf:
-            for field in cf.all_fields():
-                if hasattr(conf, field.name):
-                    # convert Date to date string; just copy others
-                    if field.name.endswith('Date'):
-                        setattr(cf, field.name, str(getattr(conf, field.name)))
-                    else:
-                        setattr(cf, field.name, getattr(conf, field.name))
-                elif field.name == "websafeConferenceKey" and hasattr(conf, "key"):
-                    setattr(cf, field.name, conf.key.urlsafe())
+            _applyPlan(CONFERENCE_PLAN, conf, cf)
+            if getattr(conf, 'key', None):
+                cf.websafeConferenceKey = conf.key.urlsafe()
         if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
+            cf.organizerDisplayName = displayName
         cf.check_initialized()
         return cf
 
+    def toConferenceForms(self, confs):
+        """Return the list of ConferenceForms of a list of Conferences."""
+        return [self.toConferenceForm(conf) for conf in confs]
+
     def toConferenceSessionForm(self, conf_sess=None, displayName=None):
         """Copy relevant fields from ConferenceSession to ConferenceSessionForm."""
         cf = ConferenceSessionForm()
         if conf_sess:
-            for field in cf.all_fields():
-                if hasattr(conf_sess, field.name):
-                    # convert Date to date string
-                    if field.name == "date":
-                        setattr(cf, field.name, str(getattr(conf_sess, field.name)))
-                    elif field.name == "startTime":
-                        setattr(cf, field.name, conf_sess.startTime.strftime("%H:%M %p"))
-                    elif field.name == 'typeOfSession':
-                        setattr(cf, field.name, getattr(SessionType, getattr(conf_sess, field.name)))
-                    else:
-                        setattr(cf, field.name, getattr(conf_sess, field.name))
-                elif field.name == "websafeSessionKey" and hasattr(conf_sess, "key"):
-                    setattr(cf, field.name, str(conf_sess.key.urlsafe()))
+            _applyPlan(SESSION_PLAN, conf_sess, cf)
+            if getattr(conf_sess, 'key', None):
+                cf.websafeSessionKey = conf_sess.key.urlsafe()
             if displayName:
-                setattr(cf, 'speakerDisplayName', displayName)
+                cf.speakerDisplayName = displayName
         cf.check_initialized()
         return cf
 
+    def toConferenceSessionForms(self, sessions, speakerNames=None):
+        """Return the list of ConferenceSessionForms of a list of ConferenceSessions, with
+        speaker names looked up by websafe speaker key in speakerNames when given."""
+        speakerNames = speakerNames or {}
+        return [self.toConferenceSessionForm(sess, speakerNames.get(sess.speakerUserId)) for sess in sessions]
+
     def toProfileForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
         pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
+        _applyPlan(PROFILE_PLAN, prof, pf)
         pf.check_initialized()
         return pf
 
+    def toProfileForms(self, profiles):
+        """Return the list of ProfileForms of a list of Profiles."""
+        return [self.toProfileForm(prof) for prof in profiles]
+
     def toSpeakerForm(self, speaker, displayName=None, websafeSpeakerKey=None):
-        """Copy relevant fields from Speaker to SpeakerForm."""
+        """Copy relevant fields from Speaker (or a SpeakerForm request) to SpeakerForm."""
         sp = SpeakerForm()
-        for field in ('sessionKeysToSpeakAt', 'mainEmail', 'displayName', 'websafeSpeakerKey'):
-            if hasattr(speaker, field):
-                setattr(sp, field, getattr(speaker, field))
-            elif field == 'websafeSpeakerKey' and hasattr(speaker, 'key'):
-                setattr(sp, field, speaker.key.urlsafe())
+        _applyPlan(SPEAKER_PLAN, speaker, sp)
+        if getattr(speaker, 'key', None):
+            sp.websafeSpeakerKey = speaker.key.urlsafe()
         if displayName:
-            setattr(sp, 'displayName', displayName)
+            sp.displayName = displayName
         if websafeSpeakerKey:
-            setattr(sp, 'websafeSpeakerKey', websafeSpeakerKey)
+            sp.websafeSpeakerKey = websafeSpeakerKey
         sp.check_initialized()
         return sp
 
+    def toSpeakerForms(self, speakers):
+        """Return the list of SpeakerForms of a list of Speakers."""
+        return [self.toSpeakerForm(speaker) for speaker in speakers]
+
     def toWishlistForm(self, wish=None):
         """Copy relevant fields from Wishlist to WishlistForm."""
         wl = WishlistForm()
         if wish:
-            for sess in wish.get('sessions'):
-                wl.sessions.append(self.toConferenceSessionForm(sess))
+            wl.sessions = self.toConferenceSessionForms(wish.get('sessions'), wish.get('speakerNames'))
         wl.check_initialized()
         return wl
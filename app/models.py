@@ -36,6 +36,7 @@ class ProfileForm(messages.Message):
 class ProfileForms(messages.Message):
     """ProfileForms -- multiple Profile outbound form message"""
     profiles = messages.MessageField(ProfileForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
     
 
 class BooleanMessage(messages.Message):
@@ -60,6 +61,17 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    organizerDisplayName = ndb.StringProperty(indexed=False)
+
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of the seats available for a conference"""
+    seatsAvailable = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class NearlySoldOut(ndb.Model):
+    """NearlySoldOut -- names of the nearly sold out conferences, by websafe conference key"""
+    conferences = ndb.JsonProperty(default={})
 
 
 class ConferenceForm(messages.Message):
@@ -81,6 +93,7 @@ class ConferenceForm(messages.Message):
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 
 class ConferenceSession(ndb.Model):
@@ -110,6 +123,7 @@ class ConferenceSessionForm(messages.Message):
 class ConferenceSessionForms(messages.Message):
     """ConferenceSessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(ConferenceSessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 
 class SessionType(messages.Enum):
@@ -158,6 +172,15 @@ class SpeakerForm(messages.Message):
 class SpeakerForms(messages.Message):
     """SpeakerForms -- multiple Speaker outbound form message"""
     speakers = messages.MessageField(SpeakerForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+class ConferenceDetailForm(messages.Message):
+    """ConferenceDetailForm -- Conference with its sessions, speakers and the caller's registration outbound form message"""
+    conference = messages.MessageField(ConferenceForm, 1)
+    sessions = messages.MessageField(ConferenceSessionForm, 2, repeated=True)
+    speakers = messages.MessageField(SpeakerForm, 3, repeated=True)
+    isUserAttending = messages.BooleanField(4)
 
 
 class Wishlist(ndb.Model):
@@ -170,6 +193,20 @@ class WishlistForm(messages.Message):
     sessions = messages.MessageField(ConferenceSessionForm, 1, repeated=True)
 
 
+class SessionQueryForm(messages.Message):
+    """SessionQueryForm -- ConferenceSession query inbound form message"""
+    field = messages.StringField(1)
+    operator = messages.StringField(2)
+    value = messages.StringField(3)
+
+
+class SessionQueryForms(messages.Message):
+    """SessionQueryForms -- multiple SessionQueryForm inbound form message"""
+    filters = messages.MessageField(SessionQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(3)
+
+
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
     field = messages.StringField(1)
@@ -180,4 +217,6 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(3)
 
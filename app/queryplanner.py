@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+"""
+queryplanner.py -- plans and runs conference queries without composite indexes
+
+A query is split into a filter pushed down to the datastore, which only needs
+the built-in single property index, and residual predicates that are evaluated
+in memory. The pushed filter is either one equality or every bound on a single
+field (a range), whichever candidate is the most selective, as measured with
+capped keys-only counts run in parallel; when no candidate is selective
+enough, every conference is scanned in name order instead. Any query reading
+more than QUERY_SCAN_BUDGET conferences is abandoned with ScanBudgetExceeded.
+The matches of an index plan are cached by key in memcache while its first
+page is read, so later pages only read their own conferences.
+The plan chosen and the rows scanned and returned are logged and totalled in
+PLAN_STATS.
+"""
+
+import hashlib
+import logging
+import threading
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+
+import entitycache
+from sessionfilter import COMPARATORS
+
+from settings import MEMCACHE_QUERY_RESULT_PREFIX
+from settings import PLANNER_PROBE_LIMIT
+from settings import QUERY_BATCH_SIZE
+from settings import QUERY_RESULT_TTL
+from settings import QUERY_SCAN_BUDGET
+
+
+_lock = threading.Lock()
+
+# plan description -> [number of queries, rows scanned, rows returned]
+PLAN_STATS = {}
+
+
+class ScanBudgetExceeded(Exception):
+    """Raised when a query would read more than QUERY_SCAN_BUDGET conferences"""
+
+
+def _filterNode(filtr):
+    return ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
+
+
+def _compileFilter(filtr):
+    """Return a function testing a conference against one filter; like the datastore,
+    a repeated property matches when any of its values does"""
+    field = filtr["field"]
+    compare = COMPARATORS[filtr["operator"]]
+    value = filtr["value"]
+
+    def test(conf):
+        data = getattr(conf, field)
+        if isinstance(data, list):
+            return any(compare(v, value) for v in data)
+        return data is not None and compare(data, value)
+    return test
+
+
+def compilePredicate(filters, selectivity=None):
+    """Return a function testing a conference against every filter. The tests run most
+    selective first (fewest matches in selectivity, a filter position -> count map),
+    then the other equalities, so that most conferences are rejected by the first test."""
+    selectivity = selectivity or {}
+    ordered = sorted(enumerate(filters), key=lambda item: (
+        selectivity.get(item[0], PLANNER_PROBE_LIMIT), item[1]["operator"] != "="))
+    tests = [_compileFilter(f) for i, f in ordered]
+    return lambda conf: all(test(conf) for test in tests)
+
+
+def _candidates(filters):
+    """Return the groups of filter positions that can be pushed down together: each
+    equality on its own, and every bound on one field for the inequalities (NE aside)"""
+    groups = [(i,) for i, f in enumerate(filters) if f["operator"] == "="]
+    ranges = {}
+    for i, f in enumerate(filters):
+        if f["operator"] not in ("=", "!="):
+            ranges.setdefault(f["field"], []).append(i)
+    groups.extend(tuple(positions) for field, positions in sorted(ranges.items()))
+    return groups
+
+
+class QueryPlan(object):
+    """The filters pushed down to the datastore (none for a full scan) and the residual predicate"""
+
+    def __init__(self, filters, pushed=(), selectivity=None):
+        self.filters = filters
+        self.pushed = tuple(pushed)
+        positions = [i for i in range(len(filters)) if i not in self.pushed]
+        self.residual = [filters[i] for i in positions]
+        selectivity = selectivity or {}
+        self.predicate = compilePredicate(
+            self.residual, dict((n, selectivity[i]) for n, i in enumerate(positions) if i in selectivity))
+
+    def query(self):
+        """Return the datastore query for the pushed filters"""
+        return Conference.query(*[_filterNode(self.filters[i]) for i in self.pushed])
+
+    def cacheKey(self):
+        """Return the memcache key of the matches of the plan"""
+        filters = repr((self.pushed, [sorted(f.items()) for f in self.filters]))
+        return MEMCACHE_QUERY_RESULT_PREFIX + hashlib.sha1(filters).hexdigest()
+
+    def describe(self):
+        """Return a readable description of the plan, e.g. "index(city = 'London') + filter(month > 6)" """
+        if not self.pushed:
+            plan = 'scan(name)'
+        else:
+            plan = 'index(%s)' % ', '.join(_describeFilter(self.filters[i]) for i in self.pushed)
+        if self.residual:
+            plan += ' + filter(%s)' % ', '.join(_describeFilter(f) for f in self.residual)
+        return plan
+
+
+def _describeFilter(filtr):
+    return '%s %s %r' % (filtr["field"], filtr["operator"], filtr["value"])
+
+
+def plan(filters):
+    """Choose the plan of a query: push down the candidate matching the fewest conferences,
+    or scan every conference when none matches fewer than PLANNER_PROBE_LIMIT"""
+    candidates = _candidates(filters)
+    if not candidates:
+        return QueryPlan(filters)
+
+    # the probes only read the built-in indexes and are run in parallel
+    probes = [QueryPlan(filters, group).query().count_async(limit=PLANNER_PROBE_LIMIT)
+              for group in candidates]
+    counts = [probe.get_result() for probe in probes]
+
+    # a range probe counts all of its bounds at once; credit each of them with it
+    selectivity = {}
+    for group, count in zip(candidates, counts):
+        for i in group:
+            selectivity[i] = count
+
+    count, pushed = min(zip(counts, candidates))
+    if count >= PLANNER_PROBE_LIMIT:
+        return QueryPlan(filters, selectivity=selectivity)
+    return QueryPlan(filters, pushed, selectivity)
+
+
+@ndb.tasklet
+def _matchAsync(query_plan):
+    """Read every conference matching the pushed filters, in parallel batches, and return
+    those matching the residual predicate in name order, and the number read"""
+    keys = yield query_plan.query().fetch_async(
+        QUERY_SCAN_BUDGET + 1, keys_only=True, batch_size=QUERY_BATCH_SIZE)
+    if len(keys) > QUERY_SCAN_BUDGET:
+        raise ScanBudgetExceeded()
+
+    wscks = [key.urlsafe() for key in keys]
+    batches = yield [entitycache.getEntitiesAsync(wscks[i:i + QUERY_BATCH_SIZE])
+                     for i in range(0, len(wscks), QUERY_BATCH_SIZE)]
+
+    matched = [conf for batch in batches for conf in batch if conf and query_plan.predicate(conf)]
+    matched.sort(key=lambda conf: conf.name)
+    raise ndb.Return(matched, len(keys))
+
+
+@ndb.tasklet
+def _runIndexPlanAsync(query_plan, page_size, offset):
+    """Return one page of the conferences matching an index plan in name order. The first page
+    reads every match and caches their keys for QUERY_RESULT_TTL seconds; later pages only
+    read their own conferences from that list, unless it has expired."""
+    ctx = ndb.get_context()
+    wscks = (yield ctx.memcache_get(query_plan.cacheKey())) if offset else None
+
+    if wscks is None:
+        matched, scanned = yield _matchAsync(query_plan)
+        wscks = [conf.key.urlsafe() for conf in matched]
+        try:
+            yield ctx.memcache_set(query_plan.cacheKey(), wscks, time=QUERY_RESULT_TTL)
+        except ValueError:
+            # larger than a memcache value can be; later pages read every match again
+            pass
+        page = matched[offset:offset + page_size]
+    else:
+        # conferences deleted since the first page are left out
+        page = [conf for conf in (yield entitycache.getEntitiesAsync(wscks[offset:offset + page_size])) if conf]
+        scanned = len(page)
+
+    next_token = None
+    if offset + page_size < len(wscks):
+        next_token = '%s:%d' % (','.join(str(i) for i in query_plan.pushed), offset + page_size)
+    raise ndb.Return(page, next_token, scanned)
+
+
+def _runScanPlan(query_plan, page_size, cursor):
+    """Stream the conferences in name order through the predicate until a page of them matches"""
+    it = Conference.query().order(Conference.name).iter(
+        start_cursor=cursor, batch_size=QUERY_BATCH_SIZE, produce_cursors=True)
+    page = []
+    scanned = 0
+    next_token = None
+    for conf in it:
+        scanned += 1
+        if scanned > QUERY_SCAN_BUDGET:
+            raise ScanBudgetExceeded()
+        if query_plan.predicate(conf):
+            if len(page) == page_size:
+                next_token = it.cursor_before().urlsafe()
+                break
+            page.append(conf)
+    return page, next_token, scanned
+
+
+def _parseIndexToken(filters, page_token):
+    """Return the pushed filter positions and the offset held by an index plan page token"""
+    pushed, offset = page_token.split(':', 1)
+    pushed = tuple(int(i) for i in pushed.split(','))
+    offset = int(offset)
+    if pushed not in _candidates(filters) or offset < 0:
+        raise ValueError("Invalid page token: %s" % page_token)
+    return pushed, offset
+
+
+def run(filters, page_size, page_token=None):
+    """Return one page of the conferences matching every filter and the next page token.
+    Page tokens of index plans are "<pushed filter positions>:<offset>", so later pages
+    keep the plan of the first one; those of scans are query cursors. Raises ValueError
+    for a malformed page token and ScanBudgetExceeded for a query reading too much."""
+    offset = 0
+    if page_token and ':' in page_token:
+        pushed, offset = _parseIndexToken(filters, page_token)
+        query_plan = QueryPlan(filters, pushed)
+    elif page_token:
+        query_plan = QueryPlan(filters)
+    else:
+        query_plan = plan(filters)
+
+    description = query_plan.describe()
+    try:
+        if query_plan.pushed:
+            page, next_token, scanned = _runIndexPlanAsync(query_plan, page_size, offset).get_result()
+        else:
+            cursor = Cursor(urlsafe=page_token) if page_token else None
+            page, next_token, scanned = _runScanPlan(query_plan, page_size, cursor)
+    except ScanBudgetExceeded:
+        logging.warning('queryConferences plan %s exceeded the scan budget of %d', description, QUERY_SCAN_BUDGET)
+        raise
+
+    with _lock:
+        totals = PLAN_STATS.setdefault(description, [0, 0, 0])
+        totals[0] += 1
+        totals[1] += scanned
+        totals[2] += len(page)
+    logging.info('queryConferences plan %s scanned %d returned %d', description, scanned, len(page))
+
+    return page, next_token
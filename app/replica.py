@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+"""
+replica.py -- in-memory replicas of a kind, kept in step through a memcache change log
+
+A replica is a structure built in each instance from every entity of a model
+(the session filter snapshot, the search indexes). Every write appends the
+websafe keys it changed to a change log in memcache: a version counter, and
+one entry per version listing the keys. An instance whose replica is behind
+the counter replays the entries it missed, reading the changed entities by key
+(strongly consistent) and putting or deleting them in its replica, so a write
+elsewhere costs it a few gets rather than a rebuild.
+
+Only a missing replica, one too far behind, or an entry lost from memcache
+leads to a rebuild from a query over the whole kind. That query is eventually
+consistent and may miss the latest writes, so a rebuild also replays every
+entry still in memcache among the last CHANGE_LOG_REPLAY_LIMIT versions (from
+the first version the counter logged), skipping versions never written or
+expired, before it is used.
+"""
+
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from settings import CHANGE_LOG_GAP_SECONDS
+from settings import CHANGE_LOG_REPLAY_LIMIT
+from settings import CHANGE_LOG_TTL
+from settings import MEMCACHE_REPLICA_PREFIX
+from settings import QUERY_BATCH_SIZE
+
+
+def _freshVersion():
+    # counters restart from the clock after an eviction, so the versions of old entries are never reused
+    return int(time.time() * 1000)
+
+
+class Replica(object):
+    """In-memory structure derived from every entity of a model: new() returns an empty one,
+    put(data, entity) adds or updates an entity and delete(data, websafe key) removes one"""
+
+    def __init__(self, name, model, new, put, delete):
+        self.name = name
+        self.model = model
+        self._new = new
+        self._put = put
+        self._delete = delete
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+        self._gapSince = None
+
+    def _versionKey(self):
+        return '%s%s:version' % (MEMCACHE_REPLICA_PREFIX, self.name)
+
+    def _entryKey(self, version):
+        return '%s%s:%d' % (MEMCACHE_REPLICA_PREFIX, self.name, version)
+
+    def _firstKey(self):
+        return '%s%s:first' % (MEMCACHE_REPLICA_PREFIX, self.name)
+
+    def _seed(self):
+        """Start a counter from the clock, recording the first version it will log"""
+        seed = _freshVersion()
+        if memcache.add(self._versionKey(), seed):
+            memcache.set(self._firstKey(), seed + 1)
+
+    def _currentVersion(self):
+        version = memcache.get(self._versionKey())
+        if version is None:
+            # the counter was evicted; start a new one so every instance rebuilds once
+            self._seed()
+            version = memcache.get(self._versionKey())
+        return version
+
+    def _loggedKeys(self, first, last):
+        """Return the keys changed by versions first to last, and the last version read before
+        an entry missing from memcache (or last); used to replay changes in order"""
+        entries = memcache.get_multi([self._entryKey(v) for v in range(first, last + 1)])
+        keys = []
+        for version in range(first, last + 1):
+            entry = entries.get(self._entryKey(version))
+            if entry is None:
+                return keys, version - 1
+            keys.extend(entry)
+        return keys, last
+
+    def _presentKeys(self, first, last):
+        """Return the keys of every entry of versions first to last still in memcache, skipping
+        missing ones; used after a rebuild, which only needs the changes its query may have missed"""
+        if first > last:
+            return []
+        entries = memcache.get_multi([self._entryKey(v) for v in range(first, last + 1)])
+        return [wsk for entry in entries.values() for wsk in entry]
+
+    @staticmethod
+    def _read(wsks):
+        """Return (websafe key, entity or None) for the given keys, read from the datastore"""
+        wsks = list(set(wsks))
+        return zip(wsks, ndb.get_multi([ndb.Key(urlsafe=wsk) for wsk in wsks]))
+
+    def _apply(self, data, entities):
+        for wsk, entity in entities:
+            if entity:
+                self._put(data, entity)
+            else:
+                self._delete(data, wsk)
+
+    def _rebuild(self, version):
+        data = self._new()
+        for entity in self.model.query().iter(batch_size=QUERY_BATCH_SIZE):
+            self._put(data, entity)
+        # the query may not see the latest writes yet; the gets of the replayed keys do
+        first = memcache.get(self._firstKey()) or 0
+        keys = self._presentKeys(max(version - CHANGE_LOG_REPLAY_LIMIT + 1, first), version)
+        self._apply(data, self._read(keys))
+        with self._lock:
+            self._data = data
+            self._version = version
+            self._gapSince = None
+
+    def _sync(self):
+        """Bring this instance's structure up to the current version of the change log"""
+        current = self._currentVersion()
+        with self._lock:
+            version = self._version
+            if self._data is not None and (version == current or current is None):
+                # up to date, or memcache is unavailable and the structure is kept as it is
+                return
+            behind = self._data is not None and version is not None and 0 < current - version
+            gap_since = self._gapSince
+
+        if current is None or not behind or current - version > CHANGE_LOG_REPLAY_LIMIT:
+            self._rebuild(current or 0)
+            return
+
+        keys, reached = self._loggedKeys(version + 1, current)
+        if reached < current and gap_since and time.time() - gap_since > CHANGE_LOG_GAP_SECONDS:
+            # the entry is not merely being written: it was evicted, so the change is lost
+            self._rebuild(current)
+            return
+        entities = self._read(keys)
+        with self._lock:
+            if self._version != version:
+                # another thread moved the structure on in the meantime
+                return
+            self._apply(self._data, entities)
+            self._version = reached
+            if reached == current:
+                self._gapSince = None
+            elif reached > version or not gap_since:
+                # first seen missing: the entry may still be being written
+                self._gapSince = time.time()
+
+    def read(self, fn):
+        """Return fn(structure) for the structure brought up to date with every logged change"""
+        self._sync()
+        with self._lock:
+            return fn(self._data)
+
+    def changed(self, wsks, apply):
+        """Log a change of the given websafe keys once the current transaction (if any) commits,
+        and apply(structure) to this instance's structure"""
+        def _log():
+            version = memcache.incr(self._versionKey())
+            if version is None:
+                self._seed()
+                version = memcache.incr(self._versionKey())
+            if version is not None:
+                memcache.set(self._entryKey(version), list(wsks), time=CHANGE_LOG_TTL)
+            with self._lock:
+                if self._data is None:
+                    return
+                apply(self._data)
+                # an instance that missed other changes stays behind, and replays them (and this one)
+                if version is not None and self._version == version - 1:
+                    self._version = version
+        ndb.get_context().call_on_commit(_log)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+responsecache.py -- memcache cache of whole endpoint responses, keyed by data generation
+
+A cached response is stored under its endpoint, a hash of its request and the
+current value of every generation counter it depends on: one per kind
+('sessions', 'speakers') and one per conference. Write paths bump the counters
+they affect once their transaction commits, so the next read computes a new
+key and misses, while the stale entries are simply never read again and age
+out of memcache. Some responses are built from global queries, which are
+eventually consistent and may not see the write that bumped the generation
+yet. So a bump also records its time, and a response is only cached when no
+scope it depends on was bumped in the RESPONSE_SETTLE_SECONDS before it was
+built and every generation is still the same once it is built; otherwise it
+is served uncached, and a later read caches it.
+"""
+
+import hashlib
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from protorpc import protobuf
+
+from settings import MEMCACHE_BUMPED_PREFIX
+from settings import MEMCACHE_GENERATION_PREFIX
+from settings import MEMCACHE_RESPONSE_PREFIX
+from settings import RESPONSE_SETTLE_SECONDS
+
+
+SESSIONS = 'sessions'
+SPEAKERS = 'speakers'
+
+
+def conferenceScope(wsck):
+    """Return the generation scope of the sessions of one conference"""
+    return 'conference:%s' % wsck
+
+
+def _freshGeneration():
+    # counters restart from the clock after an eviction, so they never go back to a value already used
+    return int(time.time() * 1000)
+
+
+def generations(scopes):
+    """Return the current generation of every scope, and the time any of them was last bumped"""
+    keys = [MEMCACHE_GENERATION_PREFIX + scope for scope in scopes]
+    bumped_keys = [MEMCACHE_BUMPED_PREFIX + scope for scope in scopes]
+    gens = memcache.get_multi(keys + bumped_keys)
+    missing = [key for key in keys if key not in gens]
+    if missing:
+        memcache.add_multi(dict((key, _freshGeneration()) for key in missing))
+        gens.update(memcache.get_multi(missing))
+    return [gens.get(key) for key in keys], max([gens.get(key, 0) for key in bumped_keys] or [0])
+
+
+def bump(*scopes):
+    """Start a new generation of every scope once the current transaction (if any) commits"""
+    def _bump():
+        memcache.set_multi(dict((MEMCACHE_BUMPED_PREFIX + scope, time.time()) for scope in scopes))
+        for scope in scopes:
+            memcache.incr(MEMCACHE_GENERATION_PREFIX + scope, initial_value=_freshGeneration())
+    ndb.get_context().call_on_commit(_bump)
+
+
+def getOrBuild(name, request, response_type, scopes, build):
+    """Return the cached response of an endpoint call, or build() it and cache it; the cache
+    is skipped when a generation could not be read from memcache"""
+    gens, bumped = generations(scopes)
+    if None in gens:
+        return build()
+
+    key = '%s%s:%s:%s' % (MEMCACHE_RESPONSE_PREFIX, name,
+                          hashlib.sha1(protobuf.encode_message(request)).hexdigest(),
+                          '.'.join(str(gen) for gen in gens))
+    data = memcache.get(key)
+    if data is not None:
+        return protobuf.decode_message(response_type, data)
+
+    settled = time.time() - bumped > RESPONSE_SETTLE_SECONDS
+    response = build()
+    if not settled or generations(scopes)[0] != gens:
+        # the queries may have missed a recent write, or a write happened while building
+        return response
+    try:
+        memcache.set(key, protobuf.encode_message(response))
+    except ValueError:
+        # larger than a memcache value can be; served uncached
+        pass
+    return response
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""
+rpcstats.py -- per endpoint instrumentation of ConferenceApi
+
+Every endpoint method is wrapped with instrument(), which records the wall
+time of each call, the datastore RPCs it issued and the time spent waiting on
+them, its memcache hits and misses and the size of its response (measured on
+one call in STATS_PAYLOAD_SAMPLE_EVERY, as it means encoding the response
+once more). The RPCs are
+observed through apiproxy hooks, which see every call the ndb context makes.
+Aggregates are kept per instance in ENDPOINT_STATS, and every
+STATS_FLUSH_SECONDS an instance adds what it recorded since its last flush to
+memcache counters (one per figure and histogram bucket), so that the admin
+stats handler can serve the totals of every instance.
+"""
+
+import functools
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from protorpc import messages
+from protorpc import protojson
+
+from settings import MEMCACHE_STATS_PREFIX
+from settings import STATS_FLUSH_SECONDS
+from settings import STATS_PAYLOAD_SAMPLE_EVERY
+
+
+_local = threading.local()
+_lock = threading.Lock()
+
+# upper bounds, in milliseconds, of the wall time histogram buckets; the last bucket is unbounded
+BUCKETS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# figures of EndpointStats kept as memcache counters, besides the histogram buckets
+_COUNTERS = ('calls', 'errors', 'wallMs', 'datastoreRpcs', 'datastoreMs',
+             'memcacheHits', 'memcacheMisses', 'payloadBytes', 'payloadSamples')
+
+
+class EndpointStats(object):
+    """Totals and wall time histogram of the calls of one endpoint"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.wallMs = 0.0
+        self.datastoreRpcs = 0
+        self.datastoreMs = 0.0
+        self.memcacheHits = 0
+        self.memcacheMisses = 0
+        self.payloadBytes = 0
+        self.payloadSamples = 0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def record(self, wall_ms, usage, payload_bytes, error):
+        self.calls += 1
+        self.errors += 1 if error else 0
+        self.wallMs += wall_ms
+        self.datastoreRpcs += usage['datastoreRpcs']
+        self.datastoreMs += usage['datastoreMs']
+        self.memcacheHits += usage['memcacheHits']
+        self.memcacheMisses += usage['memcacheMisses']
+        if payload_bytes is not None:
+            self.payloadBytes += payload_bytes
+            self.payloadSamples += 1
+        self.histogram[_bucket(wall_ms)] += 1
+
+    def counters(self):
+        """Return the figures as integers, by counter name"""
+        counters = dict((name, int(round(getattr(self, name)))) for name in _COUNTERS)
+        counters.update(('bucket%d' % i, count) for i, count in enumerate(self.histogram))
+        return counters
+
+    @classmethod
+    def fromCounters(cls, counters):
+        stats = cls()
+        for name in _COUNTERS:
+            setattr(stats, name, counters.get(name) or 0)
+        stats.histogram = [counters.get('bucket%d' % i) or 0 for i in range(len(stats.histogram))]
+        return stats
+
+    def percentile(self, p):
+        """Return the upper bound of the bucket holding the p-th percentile of the wall time
+        (None when it falls in the unbounded bucket)"""
+        rank = p / 100.0 * self.calls
+        seen = 0
+        for i, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else None
+        return None
+
+    def toDict(self):
+        calls = self.calls or 1
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'p50Ms': self.percentile(50),
+            'p95Ms': self.percentile(95),
+            'p99Ms': self.percentile(99),
+            'meanWallMs': round(self.wallMs / calls, 1),
+            'meanDatastoreRpcs': round(float(self.datastoreRpcs) / calls, 2),
+            'meanDatastoreMs': round(self.datastoreMs / calls, 1),
+            'memcacheHits': self.memcacheHits,
+            'memcacheMisses': self.memcacheMisses,
+            'meanPayloadBytes': self.payloadBytes // (self.payloadSamples or 1),
+            'payloadSamples': self.payloadSamples,
+            'histogram': dict(zip([str(b) for b in BUCKETS] + ['inf'], self.histogram)),
+        }
+
+
+# endpoint name -> EndpointStats
+ENDPOINT_STATS = {}
+
+# endpoint name -> EndpointStats of the calls not yet flushed to memcache
+_unflushed = {}
+_lastFlush = time.time()
+
+# names of every instrumented endpoint
+_ENDPOINTS = set()
+
+
+def _bucket(wall_ms):
+    for i, bound in enumerate(BUCKETS):
+        if wall_ms <= bound:
+            return i
+    return len(BUCKETS)
+
+
+def _usage():
+    """Return the counters of the current thread, creating them on first use"""
+    usage = getattr(_local, 'usage', None)
+    if usage is None:
+        usage = _local.usage = {'datastoreRpcs': 0, 'datastoreMs': 0.0,
+                                'memcacheHits': 0, 'memcacheMisses': 0}
+        _local.started = {}
+    return usage
+
+
+def _preCall(service, call, request, response):
+    """apiproxy pre-call hook; counts the datastore RPCs of the current thread and times them"""
+    _usage()['datastoreRpcs'] += 1
+    _local.started[id(request)] = time.time()
+
+
+def _postCall(service, call, request, response):
+    """apiproxy post-call hook; adds up the time the datastore RPC took, or counts memcache hits"""
+    usage = _usage()
+    if service == 'memcache':
+        if call == 'Get':
+            hits = response.item_size()
+            usage['memcacheHits'] += hits
+            usage['memcacheMisses'] += request.key_size() - hits
+        return
+    started = _local.started.pop(id(request), None)
+    if started is not None:
+        usage['datastoreMs'] += (time.time() - started) * 1000
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('rpcstats', _preCall, 'datastore_v3')
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('rpcstats', _postCall, 'datastore_v3')
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('rpcstats-memcache', _postCall, 'memcache')
+
+
+def datastoreRpcCount():
+    """Return the number of datastore RPCs issued so far by the current thread"""
+    return _usage()['datastoreRpcs']
+
+
+def _counterKey(name, counter):
+    return '%s%s:%s' % (MEMCACHE_STATS_PREFIX, name, counter)
+
+
+def flush():
+    """Add the figures recorded since the last flush to the memcache counters of every instance"""
+    global _lastFlush
+    with _lock:
+        unflushed = dict(_unflushed)
+        _unflushed.clear()
+        _lastFlush = time.time()
+    deltas = {}
+    for name, stats in unflushed.items():
+        deltas.update((_counterKey(name, counter), delta)
+                      for counter, delta in stats.counters().items() if delta)
+    if deltas:
+        memcache.offset_multi(deltas, initial_value=0)
+
+
+def instrument(func):
+    """Decorator recording the wall time, datastore and memcache usage of each call of an
+    endpoint method, and the response size of a sample of them"""
+    _ENDPOINTS.add(func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        before = dict(_usage())
+        start = time.time()
+        result = None
+        error = True
+        try:
+            result = func(*args, **kwargs)
+            error = False
+            return result
+        finally:
+            wall_ms = (time.time() - start) * 1000
+            usage = dict((k, v - before[k]) for k, v in _usage().items())
+            with _lock:
+                stats = ENDPOINT_STATS.setdefault(func.__name__, EndpointStats())
+                sampled = stats.calls % STATS_PAYLOAD_SAMPLE_EVERY == 0
+            payload_bytes = None
+            if sampled:
+                payload_bytes = len(protojson.encode_message(result)) if isinstance(result, messages.Message) else 0
+            with _lock:
+                stats.record(wall_ms, usage, payload_bytes, error)
+                _unflushed.setdefault(func.__name__, EndpointStats()).record(wall_ms, usage, payload_bytes, error)
+                due = time.time() - _lastFlush > STATS_FLUSH_SECONDS
+            if due:
+                flush()
+            logging.debug('%s took %dms, issued %d datastore RPCs (%dms)',
+                          func.__name__, wall_ms, usage['datastoreRpcs'], usage['datastoreMs'])
+    return wrapper
+
+
+def snapshot():
+    """Return the aggregates of every endpoint recorded by this instance as a dict"""
+    with _lock:
+        return dict((name, stats.toDict()) for name, stats in ENDPOINT_STATS.items())
+
+
+def globalSnapshot():
+    """Return the aggregates of every endpoint summed over every instance as a dict, from the
+    memcache counters; other instances' calls show up once they have flushed"""
+    flush()
+    names = sorted(_ENDPOINTS)
+    counters = list(_COUNTERS) + ['bucket%d' % i for i in range(len(BUCKETS) + 1)]
+    values = memcache.get_multi([_counterKey(name, counter) for name in names for counter in counters])
+    result = {}
+    for name in names:
+        stats = EndpointStats.fromCounters(dict(
+            (counter, values.get(_counterKey(name, counter))) for counter in counters))
+        if stats.calls:
+            result[name] = stats.toDict()
+    return result
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""
+searchindex.py -- in-memory full-text search over conferences and sessions
+
+Each instance keeps an inverted index per searchable kind, mapping every word
+of the indexed properties to the documents it appears in and how often. A
+search matches documents containing every query word, each word also matching
+longer words it is a prefix of, and ranks them by TF-IDF. Each index is a
+replica (see replica.py): writes made by this instance are applied to it
+directly, and the other instances replay them from the kind's change log.
+"""
+
+import bisect
+import collections
+import itertools
+import math
+import re
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceSession
+
+from replica import Replica
+
+
+# searchable kind -> (model class, properties indexed)
+KINDS = {
+    'conference': (Conference, ('name', 'description')),
+    'session': (ConferenceSession, ('name', 'highlights')),
+}
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Split text into lower case words"""
+    return [word.lower() for word in _WORD_RE.findall(text or u'')]
+
+
+class InvertedIndex(object):
+    """Postings (word -> {document: term frequency}) of a set of documents"""
+
+    def __init__(self):
+        self.postings = {}
+        self.lengths = {}
+        self._docWords = {}
+        # sorted words, rebuilt lazily for prefix lookups once the vocabulary changes
+        self._words = None
+
+    def put(self, doc, text):
+        """Index a document, replacing what was indexed for it before"""
+        self.delete(doc)
+        words = tokenize(text)
+        if not words:
+            return
+        counts = collections.Counter(words)
+        for word, tf in counts.iteritems():
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = {}
+                self._words = None
+            postings[doc] = tf
+        self.lengths[doc] = len(words)
+        self._docWords[doc] = counts.keys()
+
+    def delete(self, doc):
+        """Remove a document from the index"""
+        for word in self._docWords.pop(doc, ()):
+            postings = self.postings[word]
+            del postings[doc]
+            if not postings:
+                del self.postings[word]
+                self._words = None
+        self.lengths.pop(doc, None)
+
+    def expand(self, prefix):
+        """Return the indexed words starting with prefix"""
+        if self._words is None:
+            self._words = sorted(self.postings)
+        start = bisect.bisect_left(self._words, prefix)
+        return list(itertools.takewhile(lambda word: word.startswith(prefix),
+                                        itertools.islice(self._words, start, None)))
+
+    def search(self, query):
+        """Return the documents matching every word of the query, best TF-IDF score first"""
+        count = len(self.lengths)
+        scores = None
+        for prefix in set(tokenize(query)):
+            prefix_scores = collections.defaultdict(float)
+            for word in self.expand(prefix):
+                postings = self.postings[word]
+                idf = math.log(float(count + 1) / (len(postings) + 1)) + 1
+                for doc, tf in postings.iteritems():
+                    prefix_scores[doc] += idf * tf / self.lengths[doc]
+            if scores is None:
+                scores = prefix_scores
+            else:
+                scores = dict((doc, score + prefix_scores[doc])
+                              for doc, score in scores.iteritems() if doc in prefix_scores)
+            if not scores:
+                return []
+
+        # ties are broken on the document so that pages are stable
+        return [doc for doc, score in sorted((scores or {}).iteritems(), key=lambda item: (-item[1], item[0]))]
+
+
+def _text(kind, entity):
+    return u' '.join(getattr(entity, prop) or u'' for prop in KINDS[kind][1])
+
+
+def _replica(kind):
+    def put(index, entity):
+        index.put(entity.key.urlsafe(), _text(kind, entity))
+    return Replica('search:' + kind, KINDS[kind][0], InvertedIndex, put, InvertedIndex.delete)
+
+
+_replicas = dict((kind, _replica(kind)) for kind in KINDS)
+
+
+def search(kind, query):
+    """Return the websafe keys of the entities of a kind matching a query, best match first"""
+    return _replicas[kind].read(lambda index: index.search(query))
+
+
+def documentsWritten(kind, *entities):
+    """Record entities of a kind that were created or updated"""
+    def apply(index):
+        for entity in entities:
+            index.put(entity.key.urlsafe(), _text(kind, entity))
+    _replicas[kind].changed([entity.key.urlsafe() for entity in entities], apply)
+
+
+def documentsDeleted(kind, *keys):
+    """Record entities of a kind that were deleted (ndb.Key or websafe strings)"""
+    wsks = [k.urlsafe() if isinstance(k, ndb.Key) else k for k in keys]
+
+    def apply(index):
+        for wsk in wsks:
+            index.delete(wsk)
+    _replicas[kind].changed(wsks, apply)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""
+seatcounter.py -- sharded counter of the seats available for each conference
+
+The seats of a conference are split across SEAT_SHARD_COUNT root SeatShard
+entities, so concurrent registrations update different entity groups instead
+of all rewriting the Conference. A shard never goes below zero, so the
+conference can never be oversold. The sum of the shards is cached in memcache,
+and Conference.seatsAvailable is brought up to date by a deduplicated task.
+"""
+
+import random
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SeatShard
+
+from entitycache import invalidate
+
+from settings import SEAT_SHARD_COUNT
+from settings import SEAT_SYNC_INTERVAL
+from settings import MEMCACHE_SEATS_PREFIX
+from settings import MEMCACHE_SEATS_TTL
+
+
+def shardKeys(wsck):
+    """Return the keys of every seat shard of a conference"""
+    return [ndb.Key(SeatShard, '%s-%d' % (wsck, i)) for i in range(SEAT_SHARD_COUNT)]
+
+
+def _newShards(wsck, seats):
+    """Build shards sharing out the seats as evenly as possible"""
+    each, rest = divmod(max(seats or 0, 0), SEAT_SHARD_COUNT)
+    return [SeatShard(key=key, seatsAvailable=each + (1 if i < rest else 0))
+            for i, key in enumerate(shardKeys(wsck))]
+
+
+def createShards(wsck, seats):
+    """Create the seat shards of a new conference"""
+    ndb.put_multi(_newShards(wsck, seats))
+    memcache.delete(MEMCACHE_SEATS_PREFIX + wsck)
+
+
+@ndb.transactional(xg=True)
+def _createMissingShards(conf_key):
+    if any(ndb.get_multi(shardKeys(conf_key.urlsafe()))):
+        return
+    conf = conf_key.get()
+    if conf:
+        ndb.put_multi(_newShards(conf_key.urlsafe(), conf.seatsAvailable))
+
+
+def getShards(conf):
+    """Return the seat shards of a conference, first creating them from
+    Conference.seatsAvailable for conferences stored before shards existed"""
+    shards = ndb.get_multi(shardKeys(conf.key.urlsafe()))
+    if not all(shards):
+        _createMissingShards(conf.key)
+        shards = ndb.get_multi(shardKeys(conf.key.urlsafe()))
+    return shards
+
+
+def pickShard(shards, free=True):
+    """Pick a random shard key, among the shards with seats left when free is set"""
+    candidates = [shard.key for shard in shards if shard and (shard.seatsAvailable > 0 or not free)]
+    return random.choice(candidates) if candidates else None
+
+
+def seatsAvailable(wsck, cached=True):
+    """Return the total seats available for a conference, read from memcache when cached is set
+    and possible; the total is cached briefly, as a reader may sum the shards just before a seat
+    moves, so callers acting on a change of the total read it with cached unset"""
+    seats = memcache.get(MEMCACHE_SEATS_PREFIX + wsck) if cached else None
+    if seats is None:
+        options = {} if cached else {'use_cache': False, 'use_memcache': False}
+        shards = ndb.get_multi(shardKeys(wsck), **options)
+        if not all(shards):
+            # conferences stored before shards existed get them from Conference.seatsAvailable
+            _createMissingShards(ndb.Key(urlsafe=wsck))
+            shards = ndb.get_multi(shardKeys(wsck), **options)
+        seats = sum(shard.seatsAvailable for shard in shards if shard)
+        if cached:
+            memcache.add(MEMCACHE_SEATS_PREFIX + wsck, seats, time=MEMCACHE_SEATS_TTL)
+    return seats
+
+
+def seatsChanged(wsck):
+    """Forget the cached total and schedule Conference.seatsAvailable to be refreshed;
+    at most one refresh task is queued per conference and SEAT_SYNC_INTERVAL"""
+    memcache.delete(MEMCACHE_SEATS_PREFIX + wsck)
+    window = int(time.time() / SEAT_SYNC_INTERVAL)
+    try:
+        taskqueue.add(name='sync-seats-%s-%d' % (wsck, window),
+                      params={'websafeConferenceKey': wsck},
+                      countdown=SEAT_SYNC_INTERVAL,
+                      url='/tasks/sync_seats'
+                      )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def syncConference(wsck):
+    """Copy the total of the shards onto Conference.seatsAvailable; used by the sync seats task"""
+    seats = sum(shard.seatsAvailable for shard in ndb.get_multi(shardKeys(wsck)) if shard)
+
+    @ndb.transactional()
+    def _sync():
+        conf = ndb.Key(urlsafe=wsck).get()
+        if conf and conf.seatsAvailable != seats:
+            conf.seatsAvailable = seats
+            conf.put()
+            invalidate(conf.key)
+    _sync()
+
+
+def deleteShards(wsck):
+    """Delete the seat shards of a deleted conference"""
+    ndb.delete_multi(shardKeys(wsck))
+    memcache.delete(MEMCACHE_SEATS_PREFIX + wsck)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+sessionfilter.py -- in-memory filter engine over every ConferenceSession
+
+Each instance keeps a columnar snapshot of the sessions (type, start minute,
+duration, date and conference, one compact array per column), so filters that
+the datastore cannot serve -- inequalities on several properties, != on any of
+them -- are evaluated as plain column scans. The snapshot is a replica (see
+replica.py): writes made by this instance are applied to it directly, and the
+other instances replay them from the change log.
+"""
+
+from array import array
+import itertools
+import operator
+
+from google.appengine.ext import ndb
+
+from models import ConferenceSession
+from models import SessionType
+
+from replica import Replica
+
+
+COMPARATORS = {
+    '=': operator.eq,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '!=': operator.ne,
+}
+
+# value stored for a missing property; it never satisfies a filter
+MISSING = -1
+
+
+def typeNumber(name):
+    """Return the SessionType number of a session type name"""
+    return getattr(SessionType, name).number
+
+
+def _row(sess):
+    """Return the column values of a session"""
+    return (
+        typeNumber(sess.typeOfSession) if sess.typeOfSession else MISSING,
+        sess.startTime.hour * 60 + sess.startTime.minute if sess.startTime else MISSING,
+        sess.duration if sess.duration is not None else MISSING,
+        sess.date.toordinal() if sess.date else MISSING,
+        sess.key.parent().urlsafe(),
+    )
+
+
+class SessionSnapshot(object):
+    """Columnar copy of the filterable properties of every session"""
+
+    def __init__(self):
+        self.keys = []
+        self.positions = {}
+        self.alive = array('b')
+        self.types = array('b')
+        self.startMinutes = array('h')
+        self.durations = array('i')
+        self.dates = array('i')
+        self.conferences = array('i')
+        self.conferenceIds = {}
+
+    def columns(self):
+        return {
+            'typeOfSession': self.types,
+            'startTime': self.startMinutes,
+            'duration': self.durations,
+            'date': self.dates,
+            'conference': self.conferences,
+        }
+
+    def conferenceId(self, wsck, create=False):
+        """Return the number standing for a conference in the conference column"""
+        if wsck not in self.conferenceIds:
+            if not create:
+                return MISSING
+            self.conferenceIds[wsck] = len(self.conferenceIds)
+        return self.conferenceIds[wsck]
+
+    def put(self, sess):
+        """Add a session to the snapshot, or update the row it already has"""
+        sess_type, start, duration, date, wsck = _row(sess)
+        values = (1, sess_type, start, duration, date, self.conferenceId(wsck, create=True))
+        cols = (self.alive, self.types, self.startMinutes, self.durations, self.dates, self.conferences)
+
+        wssk = sess.key.urlsafe()
+        pos = self.positions.get(wssk)
+        if pos is None:
+            self.positions[wssk] = len(self.keys)
+            self.keys.append(wssk)
+            for col, value in zip(cols, values):
+                col.append(value)
+        else:
+            for col, value in zip(cols, values):
+                col[pos] = value
+
+    def delete(self, wssk):
+        """Remove a session from the snapshot"""
+        pos = self.positions.get(wssk)
+        if pos is not None:
+            self.alive[pos] = 0
+
+    def scan(self, filters):
+        """Return the websafe keys of the live sessions matching every (column, operator, value)
+        filter, ordered by date and start time"""
+        columns = self.columns()
+        mask = self.alive.tolist()
+        for column, op, value in filters:
+            if column == 'conference':
+                value = self.conferenceId(value)
+            compare = COMPARATORS[op]
+            mask = [m and v != MISSING and compare(v, value)
+                    for m, v in itertools.izip(mask, columns[column])]
+
+        rows = list(itertools.compress(xrange(len(mask)), mask))
+        rows.sort(key=lambda r: (self.dates[r], self.startMinutes[r]))
+        return [self.keys[r] for r in rows]
+
+
+_replica = Replica('sessions', ConferenceSession, SessionSnapshot, SessionSnapshot.put, SessionSnapshot.delete)
+
+
+def querySessions(filters):
+    """Return the websafe keys of the sessions matching every (column, operator, value) filter"""
+    return _replica.read(lambda snapshot: snapshot.scan(filters))
+
+
+def sessionsWritten(*sessions):
+    """Record sessions that were created or updated"""
+    def apply(snapshot):
+        for sess in sessions:
+            snapshot.put(sess)
+    _replica.changed([sess.key.urlsafe() for sess in sessions], apply)
+
+
+def sessionsDeleted(*keys):
+    """Record sessions that were deleted (ndb.Key or websafe strings)"""
+    wssks = [k.urlsafe() if isinstance(k, ndb.Key) else k for k in keys]
+
+    def apply(snapshot):
+        for wssk in wssks:
+            snapshot.delete(wssk)
+    _replica.changed(wssks, apply)
@@ -20,6 +20,100 @@ ANDROID_AUDIENCE = WEB_CLIENT_ID
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
+
+# Seconds the announcement and featured speaker summaries are served before a background refresh,
+# seconds a cache recompute lock is held at most, and seconds other requests wait for its result
+ANNOUNCEMENT_FRESH_SECONDS = 600
+FEATURED_SPEAKER_FRESH_SECONDS = 600
+CACHE_LOCK_SECONDS = 10
+CACHE_WAIT_SECONDS = 2
+MEMCACHE_CACHE_LOCK_PREFIX = "CACHE_LOCK:"
+
+# Pull queue of the featured speaker refreshes, seconds over which the refreshes of a speaker at a
+# conference are coalesced, and the lease (seconds) and tasks per lease of its batch consumer
+FEATURED_SPEAKER_QUEUE = "featured-speaker"
+FEATURED_SPEAKER_COUNTDOWN = 5
+FEATURED_SPEAKER_LEASE_SECONDS = 60
+FEATURED_SPEAKER_BATCH_SIZE = 100
+
+# A conference with at most this many seats left (and at least one) is announced as nearly sold out
+NEARLY_SOLD_OUT_SEATS = 5
+
+# Read-through entity cache: in-process LRU size and TTL, memcache prefix and TTL (seconds)
+ENTITY_CACHE_SIZE = 1000
+ENTITY_CACHE_TTL = 30
+MEMCACHE_ENTITY_PREFIX = "ENTITY:"
+MEMCACHE_ENTITY_TTL = 600
+
+# Seconds an invalidated entity stays locked in memcache, so readers that read it before the write cannot cache it
+MEMCACHE_ENTITY_LOCK_SECONDS = 32
+
+# Sharded seat counter: shards per conference (at most 24 so they can be created in one
+# cross-group transaction), seconds between Conference.seatsAvailable refreshes, memcache prefix
+# and seconds the memcache total is kept
+SEAT_SHARD_COUNT = 10
+SEAT_SYNC_INTERVAL = 10
+MEMCACHE_SEATS_PREFIX = "SEATS:"
+MEMCACHE_SEATS_TTL = 10
+
+# Prefix of the change logs of the in-memory replicas (session filter snapshot, search indexes), seconds
+# an entry is kept, entries an instance replays at most instead of rebuilding (also replayed after a
+# rebuild, for writes its query missed), and seconds an entry may be missing before it counts as lost
+MEMCACHE_REPLICA_PREFIX = "REPLICA:"
+CHANGE_LOG_TTL = 3600
+CHANGE_LOG_REPLAY_LIMIT = 100
+CHANGE_LOG_GAP_SECONDS = 10
+
+# Prefixes of the generation counters (per kind and per conference) of cached responses, of the times
+# they were last bumped and of the responses
+MEMCACHE_GENERATION_PREFIX = "GENERATION:"
+MEMCACHE_BUMPED_PREFIX = "BUMPED:"
+MEMCACHE_RESPONSE_PREFIX = "RESPONSE:"
+
+# Seconds after a write during which responses of its generation are built but not cached, as the
+# eventually consistent queries they come from may not see the write yet
+RESPONSE_SETTLE_SECONDS = 5
+
+# Number of conferences returned per page by queryConferences
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Number of entities retrieved per datastore RPC when a query is materialized
+QUERY_BATCH_SIZE = 100
+
+# A filter matching at least this many conferences is not pushed down by the query planner;
+# the conferences are scanned in name order instead
+PLANNER_PROBE_LIMIT = 1000
+
+# Most conferences a single queryConferences call may read before it is rejected
+QUERY_SCAN_BUDGET = 5000
+
+# Seconds the name ordered matches of a queryConferences index plan are kept for its later pages, and their memcache prefix
+QUERY_RESULT_TTL = 60
+MEMCACHE_QUERY_RESULT_PREFIX = "QUERY_RESULT:"
+
+# The endpoint statistics measure the response size of one call in this many
+STATS_PAYLOAD_SAMPLE_EVERY = 20
+
+# Seconds between flushes of an instance's endpoint statistics into the memcache counters shared by every instance, and their prefix
+STATS_FLUSH_SECONDS = 10
+MEMCACHE_STATS_PREFIX = "STATS:"
+
+# Number of entities read per page by the bulk export handler
+EXPORT_BATCH_SIZE = 500
+
+# Number of conferences rewritten by each organizer display name fan-out task
+FANOUT_BATCH_SIZE = 100
+
+# Number of sessions or registrations cleaned up by each cascading delete task
+# (sessions are matched against wishlists with an IN filter, which allows at most 30 values)
+CASCADE_BATCH_SIZE = 30
+
+# Entities written per put_multi call, and the number of sessions a removed speaker
+# is detached from inside the request before the work is handed to the task queue
+PUT_BATCH_SIZE = 500
+SPEAKER_DETACH_INLINE_LIMIT = 500
 
 DEFAULTS = {
     "city": "Default City",
@@ -50,6 +144,14 @@ FIELDS = {
     'MAX_ATTENDEES': 'maxAttendees'
 }
 
+SESSION_FIELDS = {
+    'TYPE': 'typeOfSession',
+    'START_TIME': 'startTime',
+    'DURATION': 'duration',
+    'DATE': 'date',
+    'CONFERENCE': 'conference'
+}
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -60,6 +162,24 @@ SESS_BY_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     sessionType=messages.StringField(1),
 )
 
+CONF_CREATED_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    summary=messages.BooleanField(1),
+)
+
+PAGE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(2),
+)
+
+SEARCH_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+)
+
 CONF_BY_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -1036,29 +1036,51 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
             }
         }
         $scope.loading = true;
-        gapi.client.conference.queryConferences(sendFilters).
+        $scope.conferences = [];
+        $scope.queryConferencesPage(sendFilters);
+    };
+
+    /**
+     * Invokes the conference.queryConferences API for a single page of results,
+     * then follows the nextPageToken until every page has been loaded.
+     *
+     * @param sendFilters the filters sent to the API
+     * @param pageToken the token of the page to load (undefined for the first page)
+     */
+    $scope.queryConferencesPage = function (sendFilters, pageToken) {
+        var request = angular.extend({}, sendFilters);
+        if (pageToken) {
+            request.pageToken = pageToken;
+        }
+        gapi.client.conference.queryConferences(request).
             execute(function (resp) {
                 $scope.$apply(function () {
-                    $scope.loading = false;
                     if (resp.error) {
                         // The request has failed.
+                        $scope.loading = false;
                         var errorMessage = resp.error.message || '';
                         $scope.messages = 'Failed to query conferences : ' + errorMessage;
                         $scope.alertStatus = 'warning';
                         $log.error($scope.messages + ' filters : ' + JSON.stringify(sendFilters));
+                        $scope.submitted = true;
+                        return;
+                    }
+
+                    // The request has succeeded.
+                    angular.forEach(resp.items, function (conference) {
+                        $scope.conferences.push(conference);
+                    });
+
+                    if (resp.nextPageToken) {
+                        $scope.queryConferencesPage(sendFilters, resp.nextPageToken);
                     } else {
-                        // The request has succeeded.
+                        $scope.loading = false;
                         $scope.submitted = false;
                         $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
-
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
-                        });
+                        $scope.submitted = true;
                     }
-                    $scope.submitted = true;
                 });
             });
     };
@@ -1230,20 +1252,17 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
     
     /**
      * Initializes the conference detail page.
-     * Invokes the conference.getConference method and sets the returned conference in the $scope.
+     * Invokes the conference.getConferenceDetail method and sets the returned conference,
+     * its sessions and speakers and the user's registration status in the $scope.
      *
      */
     $scope.init = function () {
-        var deferred1 = $q.defer(),
-            deferred2 = $q.defer(),
-            deferred3 = $q.defer(),
-            deferred4 = $q.defer();
-            
         $scope.loading = true;
-        gapi.client.conference.getConference({
+        gapi.client.conference.getConferenceDetail({
             websafeConferenceKey: $routeParams.websafeConferenceKey
         }).execute(function (resp) {
             $scope.$apply(function () {
+                $scope.loading = false;
                 if (resp.error) {
                     // The request has failed.
                     var errorMessage = resp.error.message || '';
@@ -1251,81 +1270,26 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                         + ' ' + errorMessage;
                     $scope.alertStatus = 'warning';
                     $log.error($scope.messages);
-                    deferred1.reject($scope.messages);
-                } else {
-                    // The request has succeeded.
-                    $scope.alertStatus = 'success';
-                    $scope.conference = resp.result;
-                    deferred1.resolve(resp.result);
-                }
-            });
-        });
-        // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
-            $scope.$apply(function () {
-                if (resp.error) {
-                    // Failed to get a user profile.
-                    deferred2.reject(resp.error);
-                } else {
-                    var profile = resp.result;
-                    if (profile && profile.conferenceKeysToAttend && profile.conferenceKeysToAttend.length) {
-                        profile.conferenceKeysToAttend.forEach(function(key) {
-                            if ($routeParams.websafeConferenceKey === key) {
-                                // The user is attending the conference.
-                                $scope.alertStatus = 'info';
-                                $scope.messages = 'You are attending this conference';
-                                $scope.isUserAttending = true;
-                            }
-                        });
-                    }
-                    deferred2.resolve(profile);
-                }
-            });
-        });
-        gapi.client.conference.getConferenceSessions({
-           websafeConferenceKey: $routeParams.websafeConferenceKey 
-        }).execute(function (resp) {
-            $scope.$apply(function () {
-                if (resp.error) {
-                    // The request has failed.
-                    var errorMessage = resp.error.message || '';
-                    $scope.messages = 'Failed to query conference sessions : ' + errorMessage;
-                    $scope.alertStatus = 'warning';
-                    deferred3.reject($scope.messages);
                 } else {
                     // The request has succeeded.
-                    $scope.submitted = false;
                     $scope.alertStatus = 'success';
-                    $log.info($scope.messages);
+                    $scope.conference = resp.result.conference;
+                    $scope.speakers = resp.result.speakers || [];
 
                     $scope.sessions = [];
-                    angular.forEach(resp.items, function (session) {
+                    angular.forEach(resp.result.sessions, function (session) {
                         $scope.sessions.push(session);
                     });
-                    deferred3.resolve($scope.sessions);
+
+                    if (resp.result.isUserAttending) {
+                        // The user is attending the conference.
+                        $scope.alertStatus = 'info';
+                        $scope.messages = 'You are attending this conference';
+                        $scope.isUserAttending = true;
+                    }
                 }
             });
         });
-        gapi.client.conference.getConferenceSpeakers({
-           websafeConferenceKey: $routeParams.websafeConferenceKey 
-        }).execute(function(resp) {
-          $scope.$apply(function() {
-            if (resp.error) {
-              deferred4.reject(resp.error);
-            } else {
-              $scope.speakers = resp.speakers;
-              deferred4.resolve(resp.speakers);
-            }
-          });
-        });
-        $q.all([
-            deferred1.promise,
-            deferred2.promise,
-            deferred3.promise,
-            deferred4.promise
-        ]).finally(function() {
-            $scope.loading = false;
-        });
     };
 
     /**
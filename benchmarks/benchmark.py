@@ -0,0 +1,512 @@
+#!/usr/bin/env python
+
+"""
+benchmark.py -- benchmark of the ConferenceApi methods on the App Engine testbed
+
+Loads a synthetic data set of profiles, speakers, conferences, sessions and
+wishlists into the datastore stub, then calls each ConferenceApi method
+repeatedly and prints the throughput, latency percentiles, datastore RPC
+counts and sequential round trips (RPCs waited for one after another, of any
+service) of every method as JSON. The stubs answer each RPC inline, so RPCs
+overlapped by tasklets show up as fewer round trips than RPCs rather than as
+lower latency. A run is reproducible for a given --seed and scale, so the
+output of two commits can be compared directly:
+
+    python benchmarks/benchmark.py --sdk ~/google_appengine --conferences 200 > before.json
+
+RPCs and memcache hits are counted by the benchmark itself, and methods the
+app does not have are skipped, so --app can point at the app directory of an
+older checkout:
+
+    git worktree add /tmp/before <commit>
+    python benchmarks/benchmark.py --sdk ~/google_appengine --app /tmp/before/app > before.json
+
+The datastore stub requires the indexes listed in app/index.yaml, so a query
+that needs a missing composite index shows up as errors of its method.
+Methods deleting data (deleteConference, deleteConferenceSession,
+removeSpeaker) are left out so that every run sees the same data set;
+remove_speaker_benchmark.py measures removeSpeaker on its own.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, 'app'))
+
+CITIES = ['London', 'Paris', 'Berlin', 'Chicago', 'Tokyo', 'San Francisco', 'Sydney', 'Toronto']
+TOPICS = ['Medical Innovations', 'Programming Languages', 'Web Technologies', 'Movie Making',
+          'Health and Nutrition', 'Cloud Computing', 'Machine Learning', 'Security']
+WORDS = ['scalable', 'python', 'engine', 'datastore', 'cloud', 'mobile', 'design', 'summit',
+         'workshop', 'keynote', 'future', 'open', 'source', 'data', 'devops', 'frontend',
+         'backend', 'security', 'testing', 'performance', 'community', 'startup', 'research']
+SESSION_TYPES = ['UNKNOWN', 'WORKSHOP', 'LECTURE', 'KEYNOTE', 'MEETUP']
+
+
+def setupPaths(sdk, app_dir=APP_DIR):
+    """Put the SDK, its bundled libraries and the app on sys.path"""
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, app_dir)
+
+
+def setupTestbed(app_dir=APP_DIR):
+    """Activate the service stubs the API uses"""
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    tb = testbed.Testbed()
+    tb.activate()
+    # every write is visible to the next query, as in a steady state production datastore
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+    tb.init_datastore_v3_stub(consistency_policy=policy, require_indexes=True, root_path=app_dir)
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=app_dir)
+    tb.init_mail_stub()
+    tb.init_app_identity_stub()
+    tb.init_urlfetch_stub()
+    tb.init_user_stub()
+    return tb
+
+
+class RpcCounter(object):
+    """Count the datastore RPCs, memcache hits and memcache misses made while it is installed,
+    independently of the app's own instrumentation, so that older checkouts of the app can be
+    measured the same way"""
+
+    def __init__(self):
+        self.count = 0
+        self.memcacheHits = 0
+        self.memcacheMisses = 0
+
+    def __call__(self, service, call, request, response):
+        self.count += 1
+
+    def _memcacheCall(self, service, call, request, response):
+        if call == 'Get':
+            hits = response.item_size()
+            self.memcacheHits += hits
+            self.memcacheMisses += request.key_size() - hits
+
+    def install(self):
+        from google.appengine.api import apiproxy_stub_map
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('benchmark-rpcs', self, 'datastore_v3')
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('benchmark-memcache', self._memcacheCall, 'memcache')
+        return self
+
+
+class RoundTripCounter(object):
+    """Count sequential round trips: the longest chain of RPCs (of any service) each issued after
+    waiting for the one before it. RPCs issued together and then waited for count once, so the
+    figure shows how much a method overlaps its RPCs, which the stubs cannot show in wall time
+    since they answer every RPC as soon as it is made."""
+
+    def __init__(self):
+        self.depth = 0
+        self._issued = {}
+
+    def reset(self):
+        self.depth = 0
+        self._issued.clear()
+
+    def install(self):
+        from google.appengine.api import apiproxy_rpc
+        from google.appengine.api import apiproxy_stub_map
+
+        def issued(service, call, request, response, rpc):
+            self._issued[id(rpc)] = self.depth
+
+        def waitAndCount(rpc):
+            wait(rpc)
+            depth = self._issued.pop(id(rpc), None)
+            if depth is not None:
+                self.depth = max(self.depth, depth + 1)
+
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('benchmark-round-trips', issued)
+        # every RPC, synchronous or not, ends in a Wait on its low level RPC object
+        wait = apiproxy_rpc.RPC.Wait
+        apiproxy_rpc.RPC.Wait = waitAndCount
+        return self
+
+
+def runTasks(tb, queue_name='default'):
+    """Run the push tasks queued so far (and those they queue) through main.app, returning how many ran"""
+    import webapp2
+    from google.appengine.ext import testbed
+    import main
+
+    stub = tb.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    ran = 0
+    while True:
+        tasks = stub.get_filtered_tasks(queue_names=[queue_name])
+        if not tasks:
+            return ran
+        stub.FlushQueue(queue_name)
+        for task in tasks:
+            request = webapp2.Request.blank(task.url, POST=task.extract_params())
+            request.get_response(main.app)
+            ran += 1
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _putAll(entities, batch_size=500):
+    from google.appengine.ext import ndb
+    for i in range(0, len(entities), batch_size):
+        ndb.put_multi(entities[i:i + batch_size])
+
+
+class DataSet(object):
+    """Synthetic data set; every list holds websafe keys (emails for the profiles)"""
+
+    def __init__(self):
+        self.emails = []
+        self.speakers = []
+        self.conferences = []
+        self.ownConferences = []
+        self.sessions = []
+
+
+def generate(rng, args):
+    """Store a synthetic data set at the requested scale; the first profile is the
+    benchmark user and organizes the first conferences"""
+    from google.appengine.ext import ndb
+    from models import Conference
+    from models import ConferenceSession
+    from models import Profile
+    from models import Speaker
+    from models import Wishlist
+
+    data = DataSet()
+    start_date = datetime.date(2017, 1, 1)
+
+    profiles = []
+    for i in range(args.profiles):
+        email = 'user%d@example.com' % i
+        profiles.append(Profile(id=email, displayName='User %d' % i, mainEmail=email))
+        data.emails.append(email)
+
+    # ids are allocated like the API does, so that the entities it creates never collide with these
+    first_id = Speaker.allocate_ids(size=args.speakers)[0]
+    speakers = [Speaker(id=first_id + i, displayName='Speaker %d' % i, mainEmail='speaker%d@example.com' % i)
+                for i in range(args.speakers)]
+    data.speakers = [speaker.key.urlsafe() for speaker in speakers]
+
+    conferences = []
+    for i in range(args.conferences):
+        organizer = profiles[0] if i < args.own_conferences else rng.choice(profiles)
+        begins = start_date + datetime.timedelta(days=rng.randint(0, 364))
+        max_attendees = rng.choice([0, 50, 100, 200, 500, 1000])
+        conf = Conference(
+            key=ndb.Key(Conference, Conference.allocate_ids(size=1, parent=organizer.key)[0],
+                        parent=organizer.key),
+            name='%s %d' % (_sentence(rng, 2), i),
+            description=_sentence(rng, 12),
+            organizerUserId=organizer.mainEmail,
+            organizerDisplayName=organizer.displayName,
+            topics=rng.sample(TOPICS, 2),
+            city=rng.choice(CITIES),
+            startDate=begins,
+            month=begins.month,
+            endDate=begins + datetime.timedelta(days=rng.randint(0, 3)),
+            maxAttendees=max_attendees,
+            seatsAvailable=max_attendees
+        )
+        conferences.append(conf)
+        data.conferences.append(conf.key.urlsafe())
+        if i < args.own_conferences:
+            data.ownConferences.append(conf.key.urlsafe())
+
+    # registrations take a seat of conferences that still have some
+    for profile in profiles:
+        for conf in rng.sample(conferences, min(args.registrations, len(conferences))):
+            if conf.seatsAvailable > 0:
+                conf.seatsAvailable -= 1
+                profile.conferenceKeysToAttend.append(conf.key.urlsafe())
+
+    sessions = []
+    for conf in conferences:
+        first_id = ConferenceSession.allocate_ids(size=args.sessions, parent=conf.key)[0]
+        for j in range(args.sessions):
+            speaker = rng.choice(speakers)
+            sess = ConferenceSession(
+                key=ndb.Key(ConferenceSession, first_id + j, parent=conf.key),
+                name=_sentence(rng, 3),
+                highlights=_sentence(rng, 10),
+                speakerUserId=speaker.key.urlsafe(),
+                startTime=datetime.time(rng.randint(8, 21), rng.choice([0, 15, 30, 45])),
+                duration=rng.choice([15, 30, 45, 60, 90, 120]),
+                typeOfSession=rng.choice(SESSION_TYPES),
+                date=conf.startDate
+            )
+            sessions.append(sess)
+            speaker.sessionKeysToSpeakAt.append(sess.key.urlsafe())
+    data.sessions = [sess.key.urlsafe() for sess in sessions]
+
+    wishlists = [Wishlist(key=ndb.Key(Wishlist, Wishlist.allocate_ids(size=1, parent=profile.key)[0],
+                                      parent=profile.key),
+                          sessions=rng.sample(data.sessions, min(args.wishlist, len(data.sessions))))
+                 for profile in profiles]
+
+    _putAll(profiles + speakers + conferences + sessions + wishlists)
+    try:
+        import seatcounter
+    except ImportError:
+        # checkouts from before the sharded seat counter keep the seats on the conference
+        seatcounter = None
+    if seatcounter:
+        for conf in conferences:
+            seatcounter.createShards(conf.key.urlsafe(), conf.seatsAvailable)
+    return data
+
+
+def scenarios(data):
+    """Return (method name, rng seed group, request factory) for every benchmarked method; a
+    method benchmarked with several kinds of request is listed once per kind, as 'method:kind'.
+    Methods sharing a seed group are fed the same sequence of random choices, so that
+    unregisterFromConference undoes what registerForConference did."""
+    from protorpc import message_types
+    from models import ConferenceForm
+    from models import ConferenceQueryForm
+    from models import ConferenceQueryForms
+    from models import ProfileMiniForm
+    import settings
+
+    def container(name, **fields):
+        return getattr(settings, name).combined_message_class(**fields)
+
+    def void(rng):
+        return message_types.VoidMessage()
+
+    def conference(rng):
+        return container('CONF_GET_REQUEST', websafeConferenceKey=rng.choice(data.conferences))
+
+    def session(rng):
+        return container('CONF_WISH_REQUEST', websafeSessionKey=rng.choice(data.sessions))
+
+    def speaker(rng):
+        return container('CONF_SPKR_GET_REQUEST', websafeSpeakerKey=rng.choice(data.speakers))
+
+    def page(rng):
+        return container('PAGE_GET_REQUEST', pageSize=20)
+
+    def search(rng):
+        return container('SEARCH_GET_REQUEST', query=rng.choice(WORDS)[:4], pageSize=20)
+
+    def queryConferences(rng):
+        return ConferenceQueryForms(filters=[
+            ConferenceQueryForm(field='CITY', operator='EQ', value=rng.choice(CITIES)),
+            ConferenceQueryForm(field='MONTH', operator='GT', value=str(rng.randint(1, 11))),
+            ConferenceQueryForm(field='MAX_ATTENDEES', operator='GTEQ', value='100'),
+        ], pageSize=20)
+
+    def querySessions(rng):
+        # imported here, as older checkouts have no querySessions
+        from models import SessionQueryForm
+        from models import SessionQueryForms
+        return SessionQueryForms(filters=[
+            SessionQueryForm(field='TYPE', operator='NE', value='WORKSHOP'),
+            SessionQueryForm(field='START_TIME', operator='LT', value='19:00'),
+            SessionQueryForm(field='DURATION', operator='GTEQ', value=str(rng.choice([30, 60]))),
+        ], pageSize=20)
+
+    def createConference(rng):
+        return ConferenceForm(name=_sentence(rng, 3), description=_sentence(rng, 12),
+                              city=rng.choice(CITIES), topics=rng.sample(TOPICS, 2),
+                              startDate='2017-%02d-10' % rng.randint(1, 12), maxAttendees=100)
+
+    def createSession(rng):
+        return container('CONF_SESS_POST_REQUEST', websafeConferenceKey=rng.choice(data.ownConferences),
+                         name=_sentence(rng, 3), highlights=_sentence(rng, 10),
+                         speakerUserId=rng.choice(data.speakers), duration=60, startTime='02:30 PM',
+                         date='2017-06-01')
+
+    def wishlistSession(rng):
+        return container('CONF_WISH_POST_REQUEST', websafeSessionKey=rng.choice(data.sessions))
+
+    def createSpeaker(rng):
+        n = rng.randint(0, 10 ** 6)
+        return container('CONF_SPKR_POST_REQUEST', displayName='Speaker %d' % n,
+                         mainEmail='new%d@example.com' % n)
+
+    return [
+        ('getConference', 'conference', conference),
+        ('getConferenceDetail', 'conference', conference),
+        ('getConferencesCreated', 'user', lambda rng: container('CONF_CREATED_REQUEST')),
+        ('getConferencesCreated:summary', 'user', lambda rng: container('CONF_CREATED_REQUEST', summary=True)),
+        ('queryConferences', 'query', queryConferences),
+        ('searchConferences', 'search', search),
+        ('getConferenceSessions', 'conference', conference),
+        ('getConferenceSession', 'session', session),
+        ('getAllSessions', 'page', page),
+        ('getAllSessionsByType', 'type', lambda rng: container(
+            'SESS_BY_TYPE_GET_REQUEST', sessionType=rng.choice(SESSION_TYPES))),
+        ('getConferenceSessionsByType', 'conference', lambda rng: container(
+            'CONF_BY_TYPE_GET_REQUEST', websafeConferenceKey=rng.choice(data.conferences),
+            sessionType=rng.choice(SESSION_TYPES))),
+        ('getDaytimeNonWorkshopSessions', 'user', void),
+        ('querySessions', 'query', querySessions),
+        ('searchSessions', 'search', search),
+        ('getSessionsBySpeaker', 'speaker', lambda rng: container(
+            'CONF_BY_SPKR_GET_REQUEST', speakerUserId=rng.choice(data.speakers))),
+        ('getSessionsInWishlist', 'user', void),
+        ('getProfile', 'user', void),
+        ('getProfiles', 'page', page),
+        ('getConferenceSpeakers', 'conference', conference),
+        ('getFeaturedSpeaker', 'speaker', speaker),
+        ('getSpeakers', 'page', page),
+        ('getSpeaker', 'speaker', speaker),
+        ('getConferencesToAttend', 'user', void),
+        ('getAnnouncement', 'user', void),
+        ('saveProfile', 'user', lambda rng: ProfileMiniForm(displayName='User %d' % rng.randint(0, 99))),
+        ('createConference', 'create', createConference),
+        ('createConferenceSession', 'create', createSession),
+        ('createSpeaker', 'create', createSpeaker),
+        ('addSessionToWishlist', 'wishlist', wishlistSession),
+        ('deleteSessionInWishlist', 'wishlist', session),
+        ('registerForConference', 'registration', conference),
+        ('unregisterFromConference', 'registration', conference),
+    ]
+
+
+def _percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def measure(api, name, requests, counter, cold=False, round_trips=None):
+    """Call one method with every request, returning its throughput, latency and RPC figures
+    counted by an installed RpcCounter (and sequential round trips, when given a RoundTripCounter)"""
+    import endpoints
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+
+    method = getattr(api, name)
+    hits, misses = counter.memcacheHits, counter.memcacheMisses
+    latencies = []
+    rpcs = []
+    trips = []
+    errors = 0
+    started = time.time()
+    for request in requests:
+        # every call is a new request: fresh request id (per request entity cache) and context cache
+        os.environ['REQUEST_LOG_ID'] = uuid.uuid4().hex
+        ndb.get_context().clear_cache()
+        if cold:
+            memcache.flush_all()
+        before = counter.count
+        if round_trips:
+            round_trips.reset()
+        start = time.time()
+        try:
+            method(request)
+        except endpoints.ServiceException:
+            errors += 1
+        latencies.append((time.time() - start) * 1000)
+        rpcs.append(counter.count - before)
+        if round_trips:
+            trips.append(round_trips.depth)
+    elapsed = time.time() - started
+
+    ordered = sorted(latencies)
+    result = {
+        'calls': len(requests),
+        'errors': errors,
+        'throughput': round(len(requests) / elapsed, 1) if elapsed else None,
+        'p50Ms': round(_percentile(ordered, 50), 2),
+        'p95Ms': round(_percentile(ordered, 95), 2),
+        'p99Ms': round(_percentile(ordered, 99), 2),
+        'meanMs': round(sum(latencies) / len(latencies), 2),
+        'meanDatastoreRpcs': round(float(sum(rpcs)) / len(rpcs), 2),
+        'maxDatastoreRpcs': max(rpcs),
+        'memcacheHits': counter.memcacheHits - hits,
+        'memcacheMisses': counter.memcacheMisses - misses,
+    }
+    if trips:
+        result['meanRoundTrips'] = round(float(sum(trips)) / len(trips), 2)
+        result['maxRoundTrips'] = max(trips)
+    return result
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK', '/usr/local/google_appengine'),
+                        help='path of the App Engine Python SDK (default: $APPENGINE_SDK)')
+    parser.add_argument('--app', default=APP_DIR, help='app directory to benchmark (default: this checkout)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--profiles', type=int, default=100)
+    parser.add_argument('--speakers', type=int, default=50)
+    parser.add_argument('--conferences', type=int, default=200)
+    parser.add_argument('--own-conferences', type=int, default=5,
+                        help='conferences organized by the benchmark user')
+    parser.add_argument('--sessions', type=int, default=10, help='sessions per conference')
+    parser.add_argument('--registrations', type=int, default=3, help='conferences attended per profile')
+    parser.add_argument('--wishlist', type=int, default=5, help='sessions in each wishlist')
+    parser.add_argument('--iterations', type=int, default=50, help='measured calls per method')
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured calls per method first')
+    parser.add_argument('--cold', action='store_true', help='flush memcache before every call')
+    parser.add_argument('--only', nargs='*', help='names of the methods to benchmark')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parseArgs(argv)
+    setupPaths(args.sdk, args.app)
+    tb = setupTestbed(args.app)
+    try:
+        from conference import ConferenceApi
+
+        rng = random.Random(args.seed)
+        started = time.time()
+        data = generate(rng, args)
+        load_seconds = time.time() - started
+
+        # the API is called as the benchmark user
+        os.environ['ENDPOINTS_AUTH_EMAIL'] = data.emails[0]
+        os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'example.com'
+
+        api = ConferenceApi()
+        counter = RpcCounter().install()
+        round_trips = RoundTripCounter().install()
+        results = {}
+        for name, group, factory in scenarios(data):
+            method = name.split(':')[0]
+            if args.only and name not in args.only and method not in args.only:
+                continue
+            if not hasattr(api, method):
+                # not in the checkout being measured
+                continue
+            group_rng = random.Random('%d-%s' % (args.seed, group))
+            requests = [factory(group_rng) for _ in range(args.warmup + args.iterations)]
+            if args.warmup:
+                measure(api, method, requests[:args.warmup], counter, args.cold, round_trips)
+            results[name] = measure(api, method, requests[args.warmup:], counter, args.cold, round_trips)
+
+        report = {
+            'config': dict((k, v) for k, v in vars(args).items() if k not in ('sdk', 'output')),
+            'loadSeconds': round(load_seconds, 2),
+            'results': results,
+        }
+    finally:
+        tb.deactivate()
+
+    out = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out + '\n')
+    else:
+        print(out)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""
+mapper_benchmark.py -- microbenchmark of FormMapper, in entities mapped per second
+
+Maps in-memory conferences, sessions, profiles and speakers to their forms,
+one call per entity and, where the mapper has them, through the bulk toXForms
+methods. Running it on two commits compares the mappers before and after:
+
+    python benchmarks/mapper_benchmark.py --sdk ~/google_appengine --entities 20000
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+from benchmark import CITIES
+from benchmark import SESSION_TYPES
+from benchmark import TOPICS
+from benchmark import _sentence
+from benchmark import setupPaths
+
+
+def entities(rng, count):
+    """Return (kind, per entity mapper method, bulk mapper method, entities) for every kind mapped"""
+    from google.appengine.ext import ndb
+    from models import Conference
+    from models import ConferenceSession
+    from models import Profile
+    from models import Speaker
+
+    day = datetime.date(2017, 6, 1)
+    confs = [Conference(key=ndb.Key(Profile, 'user@example.com', Conference, i + 1),
+                        name=_sentence(rng, 3), description=_sentence(rng, 12),
+                        organizerUserId='user@example.com', organizerDisplayName='User',
+                        topics=rng.sample(TOPICS, 2), city=rng.choice(CITIES), startDate=day,
+                        month=day.month, endDate=day, maxAttendees=100, seatsAvailable=50)
+             for i in range(count)]
+    sessions = [ConferenceSession(key=ndb.Key(ConferenceSession, i + 1, parent=confs[i % len(confs)].key),
+                                  name=_sentence(rng, 3), highlights=_sentence(rng, 10),
+                                  speakerUserId='speaker', startTime=datetime.time(10, 30), duration=60,
+                                  typeOfSession=rng.choice(SESSION_TYPES), date=day)
+                for i in range(count)]
+    profiles = [Profile(id='user%d@example.com' % i, displayName='User %d' % i,
+                        mainEmail='user%d@example.com' % i, teeShirtSize='M_W',
+                        conferenceKeysToAttend=['a', 'b', 'c'])
+                for i in range(count)]
+    speakers = [Speaker(id=i + 1, displayName='Speaker %d' % i, mainEmail='speaker%d@example.com' % i,
+                        sessionKeysToSpeakAt=['a', 'b'])
+                for i in range(count)]
+    return [
+        ('conference', 'toConferenceForm', 'toConferenceForms', confs),
+        ('session', 'toConferenceSessionForm', 'toConferenceSessionForms', sessions),
+        ('profile', 'toProfileForm', 'toProfileForms', profiles),
+        ('speaker', 'toSpeakerForm', 'toSpeakerForms', speakers),
+    ]
+
+
+def rate(func, items, repeat):
+    """Return the best entities per second over repeat runs of func(items)"""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func(items)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(len(items) / best) if best else None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK', '/usr/local/google_appengine'),
+                        help='path of the App Engine Python SDK (default: $APPENGINE_SDK)')
+    parser.add_argument('--entities', type=int, default=10000, help='entities of each kind')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement; the best is kept')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    setupPaths(args.sdk)
+    os.environ.setdefault('APPLICATION_ID', 'benchmark')
+    from mapper import FormMapper
+
+    mapper = FormMapper()
+    results = {}
+    for kind, single, bulk, items in entities(random.Random(args.seed), args.entities):
+        per_entity = getattr(mapper, single)
+        results[kind] = {'perEntity': rate(lambda xs: [per_entity(x) for x in xs], items, args.repeat)}
+        if hasattr(mapper, bulk):
+            results[kind]['bulk'] = rate(getattr(mapper, bulk), items, args.repeat)
+
+    config = dict((k, v) for k, v in vars(args).items() if k != 'sdk')
+    print(json.dumps({'config': config, 'entitiesPerSecond': results}, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
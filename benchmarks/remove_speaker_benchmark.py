@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""
+remove_speaker_benchmark.py -- wall time and datastore RPCs of removeSpeaker by session count
+
+For every --sessions count, stores a speaker set to speak at that many sessions
+(spread over conferences of --per-conference sessions), removes the speaker
+through ConferenceApi.removeSpeaker and then runs the detach tasks the call
+queued, reporting the wall time and datastore RPCs of the call and of the
+tasks. RPCs are counted by the benchmark itself, so --app can point at the app
+directory of an older checkout to compare before and after:
+
+    python benchmarks/remove_speaker_benchmark.py --sdk ~/google_appengine --sessions 1000 10000
+    git worktree add /tmp/before <commit>
+    python benchmarks/remove_speaker_benchmark.py --sdk ~/google_appengine --app /tmp/before/app
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import uuid
+
+from benchmark import APP_DIR
+from benchmark import RpcCounter
+from benchmark import _putAll
+from benchmark import runTasks
+from benchmark import setupPaths
+from benchmark import setupTestbed
+
+
+def store(count, per_conference):
+    """Store a speaker set to speak at count sessions, returning its websafe key"""
+    from google.appengine.ext import ndb
+    from models import Conference
+    from models import ConferenceSession
+    from models import Profile
+    from models import Speaker
+
+    organizer = Profile(id='organizer@example.com', displayName='Organizer', mainEmail='organizer@example.com')
+    speaker = Speaker(id=Speaker.allocate_ids(size=1)[0], displayName='Speaker',
+                      mainEmail='speaker-%s@example.com' % uuid.uuid4().hex)
+    day = datetime.date(2017, 6, 1)
+    entities = [organizer]
+    for first in range(0, count, per_conference):
+        conf = Conference(key=ndb.Key(Conference, Conference.allocate_ids(size=1, parent=organizer.key)[0],
+                                      parent=organizer.key),
+                          name='Conference %d' % first, organizerUserId=organizer.mainEmail,
+                          startDate=day, month=day.month, endDate=day, maxAttendees=100, seatsAvailable=100)
+        size = min(per_conference, count - first)
+        first_id = ConferenceSession.allocate_ids(size=size, parent=conf.key)[0]
+        sessions = [ConferenceSession(key=ndb.Key(ConferenceSession, first_id + i, parent=conf.key),
+                                      name='Session %d' % (first + i), speakerUserId=speaker.key.urlsafe(),
+                                      startTime=datetime.time(10, 0), duration=60, date=day)
+                    for i in range(size)]
+        speaker.sessionKeysToSpeakAt.extend(sess.key.urlsafe() for sess in sessions)
+        entities.append(conf)
+        entities.extend(sessions)
+    _putAll(entities + [speaker])
+    return speaker.key.urlsafe()
+
+
+def run(tb, count, per_conference):
+    """Remove a speaker of count sessions and return the figures of the call and of its tasks"""
+    from google.appengine.ext import ndb
+    from models import ConferenceSession
+    from conference import ConferenceApi
+    import settings
+
+    wssk = store(count, per_conference)
+    ndb.get_context().clear_cache()
+    os.environ['REQUEST_LOG_ID'] = uuid.uuid4().hex
+    request = settings.CONF_SPKR_GET_REQUEST.combined_message_class(websafeSpeakerKey=wssk)
+
+    counter = RpcCounter().install()
+    start = time.time()
+    ConferenceApi().removeSpeaker(request)
+    call_seconds = time.time() - start
+    call_rpcs = counter.count
+
+    start = time.time()
+    tasks = runTasks(tb)
+    task_seconds = time.time() - start
+
+    left = ConferenceSession.query(ConferenceSession.speakerUserId == wssk).count()
+    return {
+        'callSeconds': round(call_seconds, 3),
+        'callDatastoreRpcs': call_rpcs,
+        'tasks': tasks,
+        'taskSeconds': round(task_seconds, 3),
+        'taskDatastoreRpcs': counter.count - call_rpcs,
+        'sessionsLeftAttached': left,
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK', '/usr/local/google_appengine'),
+                        help='path of the App Engine Python SDK (default: $APPENGINE_SDK)')
+    parser.add_argument('--app', default=APP_DIR, help='app directory to benchmark (default: this checkout)')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1000, 10000],
+                        help='sessions of the removed speaker, one run per count')
+    parser.add_argument('--per-conference', type=int, default=100, help='sessions per conference')
+    args = parser.parse_args(argv)
+
+    setupPaths(args.sdk, args.app)
+    results = {}
+    for count in args.sessions:
+        # every count gets an empty datastore
+        tb = setupTestbed(args.app)
+        try:
+            results[str(count)] = run(tb, count, args.per_conference)
+        finally:
+            tb.deactivate()
+
+    config = {'app': args.app, 'perConference': args.per_conference}
+    print(json.dumps({'config': config, 'results': results}, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""
+search_benchmark.py -- benchmark of the search index over a synthetic corpus
+
+Builds an InvertedIndex over --documents synthetic documents (100k by default)
+and reports the build rate, the latency percentiles of whole word, prefix and
+two word queries, and the rate of incremental updates. It then stores
+--stored sessions in the datastore stub and compares, for two replicas of the
+session index standing for two instances, the cost of a first read (a rebuild
+from a query) with that of a read after the other instance wrote a session (a
+replay of the change log):
+
+    python benchmarks/search_benchmark.py --sdk ~/google_appengine --documents 100000
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+from benchmark import WORDS
+from benchmark import _percentile
+from benchmark import _putAll
+from benchmark import _sentence
+from benchmark import setupPaths
+from benchmark import setupTestbed
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def latencies(func, items):
+    """Return the p50/p95/p99 latency (ms) of func over items"""
+    ordered = sorted(timed(func, item) * 1000 for item in items)
+    return dict(('p%dMs' % p, round(_percentile(ordered, p), 3)) for p in (50, 95, 99))
+
+
+def benchmarkIndex(rng, documents, queries):
+    """Return the figures of an InvertedIndex over a synthetic corpus"""
+    from searchindex import InvertedIndex
+
+    docs = [('doc%d' % i, _sentence(rng, rng.randint(5, 40))) for i in range(documents)]
+    index = InvertedIndex()
+    seconds = timed(lambda: [index.put(doc, text) for doc, text in docs])
+
+    words = [rng.choice(WORDS) for _ in range(queries)]
+    updates = rng.sample(docs, min(1000, len(docs)))
+    update_seconds = timed(lambda: [index.put(doc, _sentence(rng, 20)) for doc, _ in updates])
+    return {
+        'documents': documents,
+        'words': len(index.postings),
+        'buildDocumentsPerSecond': round(documents / seconds) if seconds else None,
+        'updatesPerSecond': round(len(updates) / update_seconds) if update_seconds else None,
+        'wordQuery': latencies(index.search, words),
+        'prefixQuery': latencies(index.search, [word[:3] for word in words]),
+        'twoWordQuery': latencies(index.search, ['%s %s' % (word, rng.choice(WORDS)) for word in words]),
+    }
+
+
+def benchmarkReplica(rng, stored):
+    """Return the cost of rebuilding a session index from the datastore and of replaying a write"""
+    from google.appengine.ext import ndb
+    from models import Conference
+    from models import ConferenceSession
+    from models import Profile
+    import searchindex
+
+    organizer = Profile(id='organizer@example.com', displayName='Organizer', mainEmail='organizer@example.com')
+    conf = Conference(key=ndb.Key(Conference, 1, parent=organizer.key), name='Conference',
+                      organizerUserId=organizer.mainEmail)
+    day = datetime.date(2017, 6, 1)
+    sessions = [ConferenceSession(key=ndb.Key(ConferenceSession, i + 1, parent=conf.key), name=_sentence(rng, 3),
+                                  highlights=_sentence(rng, 10), date=day)
+                for i in range(stored)]
+    _putAll([organizer, conf] + sessions)
+
+    # two replicas of the same index, standing for two instances
+    writer = searchindex._replica('session')
+    reader = searchindex._replica('session')
+    rebuild = timed(reader.read, lambda index: None)
+    writer.read(lambda index: None)
+
+    sess = sessions[0]
+    sess.highlights = _sentence(rng, 10)
+    sess.put()
+    writer.changed([sess.key.urlsafe()], lambda index: index.put(sess.key.urlsafe(), searchindex._text('session', sess)))
+    replay = timed(reader.read, lambda index: None)
+    return {'stored': stored, 'rebuildSeconds': round(rebuild, 3), 'replaySeconds': round(replay, 4)}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK', '/usr/local/google_appengine'),
+                        help='path of the App Engine Python SDK (default: $APPENGINE_SDK)')
+    parser.add_argument('--documents', type=int, default=100000, help='documents of the in-memory corpus')
+    parser.add_argument('--queries', type=int, default=1000, help='queries of each kind')
+    parser.add_argument('--stored', type=int, default=10000, help='sessions stored for the replica comparison')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    setupPaths(args.sdk)
+    tb = setupTestbed()
+    try:
+        rng = random.Random(args.seed)
+        results = {'index': benchmarkIndex(rng, args.documents, args.queries)}
+        if args.stored:
+            results['replica'] = benchmarkReplica(rng, args.stored)
+    finally:
+        tb.deactivate()
+
+    config = dict((k, v) for k, v in vars(args).items() if k != 'sdk')
+    print(json.dumps({'config': config, 'results': results}, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""
+seat_stress_test.py -- concurrency stress test of the sharded seat counter on the datastore stub
+
+Stores a conference of --seats seats and --users profiles, then registers every
+profile from --threads threads at once through ConferenceApiHelper._registerProfile,
+the path behind registerForConference. A second round unregisters half of the
+registered profiles while the others try to register again. After each round it
+checks that the conference was never oversold: no shard is below zero, the
+registered profiles never exceed the seats, and the seats left in the shards
+plus the registered profiles add up to maxAttendees. The register round must
+also have sold min(seats, users) seats, less the registrations lost to
+contention, and no call may fail with an unexpected error (the first one is
+logged with its traceback). It prints the figures as JSON and exits with
+status 1 if a check fails:
+
+    python benchmarks/seat_stress_test.py --sdk ~/google_appengine --seats 50 --users 300 --threads 30
+"""
+
+import argparse
+import json
+import logging
+import os
+import Queue
+import sys
+import threading
+import time
+
+from benchmark import setupPaths
+from benchmark import setupTestbed
+
+
+def store(seats, users):
+    """Store the conference and the profiles, returning them"""
+    import datetime
+    from google.appengine.ext import ndb
+    from models import Conference
+    from models import Profile
+    import seatcounter
+
+    day = datetime.date(2017, 6, 1)
+    organizer = Profile(id='organizer@example.com', displayName='Organizer', mainEmail='organizer@example.com')
+    conf = Conference(key=ndb.Key(Conference, Conference.allocate_ids(size=1, parent=organizer.key)[0],
+                                  parent=organizer.key),
+                      name='Flash sale', organizerUserId=organizer.mainEmail, startDate=day,
+                      month=day.month, endDate=day, maxAttendees=seats, seatsAvailable=seats)
+    profiles = [Profile(id='user%d@example.com' % i, displayName='User %d' % i, mainEmail='user%d@example.com' % i)
+                for i in range(users)]
+    ndb.put_multi([organizer, conf] + profiles)
+    seatcounter.createShards(conf.key.urlsafe(), seats)
+    return conf, [prof.key for prof in profiles]
+
+
+def hammer(conf, work, threads):
+    """Run every (profile key, register) of work from threads threads at once; returns outcome counts"""
+    from google.appengine.api import datastore_errors
+    from models import ConflictException
+    from conferenceapihelper import ConferenceApiHelper
+
+    api = ConferenceApiHelper()
+    todo = Queue.Queue()
+    for item in work:
+        todo.put(item)
+    outcomes = {'changed': 0, 'unchanged': 0, 'soldOut': 0, 'contention': 0, 'errors': 0}
+    errors = []
+    lock = threading.Lock()
+    start = threading.Event()
+
+    def worker():
+        start.wait()
+        while True:
+            try:
+                p_key, reg = todo.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                outcome = 'changed' if api._registerProfile(p_key, conf, reg) else 'unchanged'
+            except ConflictException:
+                outcome = 'soldOut'
+            except datastore_errors.TransactionFailedError:
+                outcome = 'contention'
+            except Exception:
+                outcome = 'errors'
+                with lock:
+                    if not errors:
+                        errors.append(True)
+                        logging.exception('_registerProfile failed unexpectedly')
+            with lock:
+                outcomes[outcome] += 1
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    started = time.time()
+    start.set()
+    for thread in pool:
+        thread.join()
+    outcomes['seconds'] = round(time.time() - started, 3)
+    return outcomes
+
+
+def check(conf, p_keys, outcomes, expected=None):
+    """Return the seat figures of the conference read from the datastore, and the failed checks;
+    expected is the number of profiles the round must leave registered, if known"""
+    from google.appengine.ext import ndb
+    import seatcounter
+
+    wsck = conf.key.urlsafe()
+    ctx = ndb.get_context()
+    ctx.clear_cache()
+    shards = ndb.get_multi(seatcounter.shardKeys(wsck), use_cache=False, use_memcache=False)
+    profiles = ndb.get_multi(p_keys, use_cache=False, use_memcache=False)
+    registered = [prof.key for prof in profiles if wsck in prof.conferenceKeysToAttend]
+    left = sum(shard.seatsAvailable for shard in shards)
+
+    failures = []
+    if any(shard.seatsAvailable < 0 for shard in shards):
+        failures.append('a shard went below zero')
+    if len(registered) > conf.maxAttendees:
+        failures.append('oversold: %d registered for %d seats' % (len(registered), conf.maxAttendees))
+    if left + len(registered) != conf.maxAttendees:
+        failures.append('%d seats left and %d registered do not add up to %d'
+                        % (left, len(registered), conf.maxAttendees))
+    if outcomes['errors']:
+        failures.append('%d calls failed with an unexpected error' % outcomes['errors'])
+    if expected is not None and len(registered) != expected:
+        # otherwise a round that never sold anything would pass
+        failures.append('%d registered where %d were expected' % (len(registered), expected))
+    return {'registered': len(registered), 'seatsLeft': left}, registered, failures
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK', '/usr/local/google_appengine'),
+                        help='path of the App Engine Python SDK (default: $APPENGINE_SDK)')
+    parser.add_argument('--seats', type=int, default=50)
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--threads', type=int, default=30)
+    args = parser.parse_args(argv)
+
+    setupPaths(args.sdk)
+    tb = setupTestbed()
+    try:
+        conf, p_keys = store(args.seats, args.users)
+
+        rounds = []
+        failed = []
+        outcomes = hammer(conf, [(p_key, True) for p_key in p_keys], args.threads)
+        # a seat is only refused once every shard is empty, so only contention leaves seats unsold
+        expected = min(args.seats, args.users - outcomes['contention'])
+        figures, registered, failures = check(conf, p_keys, outcomes, expected)
+        rounds.append({'round': 'register', 'outcomes': outcomes, 'figures': figures, 'failures': failures})
+        failed.extend(failures)
+
+        # churn: half of the registered profiles leave while everybody else tries to get in
+        leaving = set(registered[:len(registered) // 2])
+        staying = set(registered) - leaving
+        work = [(p_key, p_key not in leaving) for p_key in p_keys if p_key not in staying]
+        outcomes = hammer(conf, work, args.threads)
+        figures, registered, failures = check(conf, p_keys, outcomes)
+        rounds.append({'round': 'churn', 'outcomes': outcomes, 'figures': figures, 'failures': failures})
+        failed.extend(failures)
+    finally:
+        tb.deactivate()
+
+    config = dict((k, v) for k, v in vars(args).items() if k != 'sdk')
+    print(json.dumps({'config': config, 'rounds': rounds, 'passed': not failed}, indent=2, sort_keys=True))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])